@@ -4,6 +4,7 @@ import logging
 import json
 import re
 import gzip
+import shutil
 import sqlite3
 from datetime import datetime
 from tempfile import NamedTemporaryFile
@@ -20,6 +21,12 @@ sys.path.append(script_dir)
 # Import the custom logging setup function.
 from custom_logging import setup_logging
 
+# PanelApp HTTP session and timeout shared with check_panel_updates
+from .panelapp_session import REQUEST_TIMEOUT, SESSION
+
+# Buffer size used when compressing archived databases
+COPY_BUFFER_SIZE = 1024 * 1024
+
 def set_working_directory():
     """
     Set the working directory to the location of the script.
@@ -213,7 +220,9 @@ def fetch_panels(panels_url, headers):
                 logging.debug(f"Fetching page {page} of panels.")
 
             # Send a GET request to the API with the current page number.
-            response = requests.get(panels_url, headers=headers, params={"page": page})
+            response = SESSION.get(
+                panels_url, headers=headers, params={"page": page}, timeout=REQUEST_TIMEOUT
+            )
             
             # Check if the response is successful and contains JSON data.
             if response.status_code == 200 and response.headers.get("Content-Type") == "application/json":
@@ -262,7 +271,7 @@ def fetch_panel_details(panel_id, panels_url, headers):
     
     try:
         # Send a GET request to the API for the specific panel details.
-        response = requests.get(panel_detail_url, headers=headers)
+        response = SESSION.get(panel_detail_url, headers=headers, timeout=REQUEST_TIMEOUT)
         
         # Check if the response is successful and contains JSON data.
         if response.status_code == 200 and response.headers.get("Content-Type") == "application/json":
@@ -456,7 +465,7 @@ def save_to_database(df, script_dir, table_name="panel_info"):
 
                 # Compress the old database
                 with open(archived_db_path, 'rb') as f_in, gzip.open(f"{archived_db_path}.gz", 'wb') as f_out:
-                    f_out.writelines(f_in)
+                    shutil.copyfileobj(f_in, f_out, length=COPY_BUFFER_SIZE)
                 logging.info(f"Compressed archived database: {archived_db_path}.gz")
 
                 # Remove the uncompressed file
@@ -468,6 +477,15 @@ def save_to_database(df, script_dir, table_name="panel_info"):
         logging.info(f"Connected to database '{database_path}'")
         df.to_sql(table_name, conn, if_exists="replace", index=False)
         logging.info(f"Data successfully saved to table '{table_name}' in '{database_path}'")
+
+        # Index the R code lookup used when joining with patient data
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_pi_rd_gene "
+            f"ON {table_name} (relevant_disorders, gene_ensembl_id_GRch38)"
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
+        logging.info(f"Created index idx_pi_rd_gene on table '{table_name}'")
         conn.close()
         logging.info(f"Database connection to '{database_path}' closed.")
         
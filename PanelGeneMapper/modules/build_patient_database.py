@@ -3,9 +3,12 @@ import sys
 import logging
 import argparse
 import sqlite3
-from datetime import datetime, timedelta
-import random
+import itertools
+import csv
+import hashlib
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
 
@@ -15,6 +18,21 @@ sys.path.append(script_dir)
 
 from custom_logging import setup_logging
 
+# Project directories, resolved once at import
+PROJECT_DIR = os.path.abspath(os.path.join(script_dir, "..", ".."))
+LOGS_DIR = os.path.join(PROJECT_DIR, "logs")
+DATABASES_DIR = os.path.join(PROJECT_DIR, "databases")
+PATIENT_CACHE_DIR = os.path.join(DATABASES_DIR, ".cache")
+
+# Column order of the patient_data table
+PATIENT_COLUMNS = ("patient_id", "clinical_id", "test_date", "panel_retrieved_date")
+
+# Fields every record in a patient data JSON file must provide
+REQUIRED_PATIENT_KEYS = ("patient_id", "clinical_id", "test_date")
+
+# Number of rows generated and inserted per batch
+INSERT_BATCH_SIZE = 10_000
+
 
 def load_patient_data(databases_dir, patient_data_file):
     """
@@ -32,50 +50,52 @@ def load_patient_data(databases_dir, patient_data_file):
         return None
 
     patient_data_path = os.path.join(databases_dir, patient_data_file)
-    if os.path.exists(patient_data_path):
-        logging.info(f"Loading patient data from {patient_data_path}")
-        try:
-            with open(patient_data_path, "r") as file:
-                data = pd.read_json(file).to_dict(orient="records")
-
-                # Validate required fields
-                for record in data:
-                    if not all(key in record for key in ["patient_id", "clinical_id", "test_date"]):
-                        raise ValueError(f"Invalid record in patient data: {record}")
-
-                return data
-        except ValueError as ve:
-            logging.error(f"Validation error in patient data: {ve}")
-            raise
-        except Exception as e:
-            logging.error(
-                f"Failed to load patient data from {patient_data_path}: {e}"
-            )
-            raise
-    else:
+    if not os.path.isfile(patient_data_path):
         logging.info(
             f"No patient data file found at {patient_data_path}. Using generated data."
         )
         return None
 
+    logging.info(f"Loading patient data from {patient_data_path}")
+    try:
+        with open(patient_data_path, "r") as file:
+            data = pd.read_json(file).to_dict(orient="records")
+
+            # Validate required fields
+            for record in data:
+                if not all(key in record for key in REQUIRED_PATIENT_KEYS):
+                    raise ValueError(f"Invalid record in patient data: {record}")
 
-def generate_patient_database(
-    num_patients, patient_data, clinical_ids=None, default_test_date=None
+            return data
+    except ValueError as ve:
+        logging.error(f"Validation error in patient data: {ve}")
+        raise
+    except Exception as e:
+        logging.error(
+            f"Failed to load patient data from {patient_data_path}: {e}"
+        )
+        raise
+
+
+def generate_patient_rows(
+    num_patients, patient_data, clinical_ids=None, default_test_date=None, seed=None
 ):
     """
-    Generate a patient database with options for user-defined data.
+    Generate patient rows lazily with options for user-defined data.
 
     Args:
         num_patients (int): Number of patients to generate.
         patient_data (list): User-provided patient data.
         clinical_ids (list, optional): List of clinical IDs. Defaults to None.
         default_test_date (str, optional): Default test date. Defaults to None.
+        seed (int, optional): Seed for the random generator. Defaults to None.
 
-    Returns:
-        pd.DataFrame: A DataFrame containing patient data.
+    Yields:
+        tuple: A (patient_id, clinical_id, test_date, panel_retrieved_date) row.
     """
     # Set the panel retrieved date to the current date.
-    panel_retrieved_date = datetime.now().strftime("%Y-%m-%d")
+    now = datetime.now()
+    panel_retrieved_date = now.strftime("%Y-%m-%d")
 
     # If clinical IDs are not provided, use the default list.
     if clinical_ids is None:
@@ -117,58 +137,119 @@ def generate_patient_database(
             'R220', 'R172', 'R20', 'R227',
         ]
 
-    patients = []
+    rng = np.random.default_rng(seed)
 
     # If user-provided patient data is available, use it to generate the database.
     if patient_data:
         logging.info("Using user-provided patient data.")
         for record in patient_data:
             patient_id = record.get(
-                "patient_id", f"Patient_{random.randint(10000000, 99999999)}"
+                "patient_id", f"Patient_{rng.integers(10000000, 100000000)}"
             )
-            clinical_id = record.get("clinical_id", random.choice(clinical_ids))
+            clinical_id = record.get("clinical_id", clinical_ids[rng.integers(len(clinical_ids))])
             test_date = record.get("test_date", default_test_date)
-            patients.append(
-                {
-                    "patient_id": patient_id,
-                    "clinical_id": clinical_id,
-                    "test_date": test_date,
-                    "panel_retrieved_date": panel_retrieved_date,
-                }
-            )
+            yield (patient_id, clinical_id, test_date, panel_retrieved_date)
     else:
         # Generate random patient data if no user-provided data exists.
         logging.info("Generating random patient data.")
-        for _ in range(num_patients):
-            patient_id = f"Patient_{random.randint(10000000, 99999999)}"
-            clinical_id = random.choice(clinical_ids)
-            start_of_year = datetime(datetime.now().year, 1, 1)
-            random_days = random.randint(0, (datetime.now() - start_of_year).days)
-            test_date = (
-                start_of_year + timedelta(days=random_days)
-            ).strftime("%Y-%m-%d")
-            patients.append(
-                {
-                    "patient_id": patient_id,
-                    "clinical_id": clinical_id,
-                    "test_date": test_date,
-                    "panel_retrieved_date": panel_retrieved_date,
-                }
-            )
+        clinical_id_choices = np.asarray(clinical_ids, dtype=object)
+
+        # Test dates fall between the start of the year and today.
+        start_of_year = np.datetime64(f"{now.year}-01-01", "D")
+        max_offset = int((np.datetime64(now.date(), "D") - start_of_year).astype(int))
+
+        # Generate in batches so memory stays bounded for large runs.
+        for batch_start in range(0, num_patients, INSERT_BATCH_SIZE):
+            batch_size = min(INSERT_BATCH_SIZE, num_patients - batch_start)
+            offsets = rng.integers(0, max_offset + 1, size=batch_size)
+            test_dates = (start_of_year + offsets.astype("timedelta64[D]")).astype(str)
+            patient_ids = rng.integers(10000000, 100000000, size=batch_size)
+            batch_clinical_ids = rng.choice(clinical_id_choices, size=batch_size)
+
+            for patient_id, clinical_id, test_date in zip(
+                patient_ids.tolist(), batch_clinical_ids.tolist(), test_dates.tolist()
+            ):
+                yield (f"Patient_{patient_id}", clinical_id, test_date, panel_retrieved_date)
+
+
+def get_patient_cache_path(num_patients, seed, default_test_date, cache_dir=PATIENT_CACHE_DIR):
+    """
+    Build the cache file path for a seeded run of generated patient rows.
+
+    The key includes today's date because generated rows carry it as the
+    panel_retrieved_date and draw test dates up to it.
+
+    Args:
+        num_patients (int): Number of patients to generate.
+        seed (int): Seed for the random generator.
+        default_test_date (str): Default test date, or None.
+        cache_dir (str): Directory holding cached rows.
+
+    Returns:
+        str: Path to the cache file.
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    key = hashlib.sha1(
+        f"{num_patients}-{seed}-{default_test_date}-{today}".encode()
+    ).hexdigest()[:16]
+    return os.path.join(cache_dir, f"patients_{key}.csv")
 
-    patient_df = pd.DataFrame(patients)
-    logging.info("Patient database generated successfully.")
-    return patient_df
 
-def save_to_database(df, databases_dir, database_name, table_name="patient_data"):
+def read_cached_patient_rows(cache_path):
     """
-    Save the DataFrame to an SQLite database in the databases directory.
+    Yield patient rows from a cache file written by cache_patient_rows.
 
     Args:
-        df (pd.DataFrame): The DataFrame to save.
+        cache_path (str): Path to the cache file.
+
+    Yields:
+        tuple: A row in PATIENT_COLUMNS order.
+    """
+    with open(cache_path, "r", newline="") as cache_file:
+        for row in csv.reader(cache_file):
+            yield tuple(row)
+
+
+def cache_patient_rows(rows, cache_path):
+    """
+    Pass patient rows through while writing them to a cache file.
+
+    The file is only moved into place once every row has been written, so an
+    interrupted run never leaves a partial cache behind.
+
+    Args:
+        rows (iterable): Rows in PATIENT_COLUMNS order.
+        cache_path (str): Path to the cache file.
+
+    Yields:
+        tuple: Each row from rows, unchanged.
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, "w", newline="") as cache_file:
+        writer = csv.writer(cache_file)
+        for row in rows:
+            writer.writerow(row)
+            yield row
+    os.replace(temp_path, cache_path)
+    logging.info(f"Cached generated patient rows to {cache_path}")
+
+
+def save_patient_rows(rows, databases_dir, database_name, table_name="patient_data"):
+    """
+    Stream patient rows into an SQLite database in the databases directory.
+
+    Rows are inserted with executemany in batches of INSERT_BATCH_SIZE, each
+    committed in its own transaction, so the full set is never held in memory.
+
+    Args:
+        rows (iterable): Rows in PATIENT_COLUMNS order.
         databases_dir (str): Path to the databases directory.
         database_name (str): Name of the database file.
         table_name (str): Name of the table to save data to. Defaults to "patient_data".
+
+    Returns:
+        int: Number of rows inserted.
     """
     try:
         # Ensure the databases directory exists
@@ -177,18 +258,43 @@ def save_to_database(df, databases_dir, database_name, table_name="patient_data"
         # Path for the database
         database_path = os.path.join(databases_dir, database_name)
 
-        # Save data to the database
         conn = sqlite3.connect(database_path)
         logging.info(f"Connected to database '{database_path}'.")
 
-        # Append the data to the table
-        df.to_sql(table_name, conn, if_exists="append", index=False)
+        columns = ", ".join(PATIENT_COLUMNS)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} "
+            f"({', '.join(f'{col} TEXT' for col in PATIENT_COLUMNS)})"
+        )
+        insert_sql = (
+            f"INSERT INTO {table_name} ({columns}) "
+            f"VALUES ({', '.join(['?'] * len(PATIENT_COLUMNS))})"
+        )
+
+        rows = iter(rows)
+        total_rows = 0
+        while True:
+            batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            with conn:
+                conn.executemany(insert_sql, batch)
+            total_rows += len(batch)
+
+        # Index the date/R code lookup used when joining with PanelApp data
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_pd_date "
+            f"ON {table_name} (panel_retrieved_date, clinical_id)"
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
 
         logging.info(
-            f"Data successfully added to table '{table_name}' in '{database_path}'."
+            f"{total_rows} rows successfully added to table '{table_name}' in '{database_path}'."
         )
         conn.close()
         logging.info("Database connection closed.")
+        return total_rows
     except Exception as e:
         logging.error(f"An error occurred while saving to the database: {e}")
         raise
@@ -235,6 +341,14 @@ def parse_arguments():
         help="Default test date in 'YYYY-MM-DD' format for generated patients.",
     )
 
+    # Seed for reproducible generated patients
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Seed for generated patient data. Seeded runs are cached and reused.",
+    )
+
     return parser.parse_args()
 
 
@@ -246,15 +360,9 @@ def main():
         # Parse arguments
         args = parse_arguments()
 
-        # Define directories
-        script_dir = os.path.abspath(os.path.dirname(__file__))
-        project_dir = os.path.abspath(os.path.join(script_dir, "..", ".."))
-        logs_dir = os.path.join(project_dir, "logs")
-        databases_dir = os.path.join(project_dir, "databases")
-
         # Set up centralized logging
         setup_logging(
-            logs_dir=logs_dir,
+            logs_dir=LOGS_DIR,
             info_log_file="build_patient_info.log",
             error_log_file="build_patient_error.log",
         )
@@ -262,19 +370,33 @@ def main():
         logging.info("Patient database script started.")
 
         # Load patient data if provided
-        patient_data = load_patient_data(databases_dir, args.patient_data_file)
+        patient_data = load_patient_data(DATABASES_DIR, args.patient_data_file)
 
-        # Generate the patient database
-        patient_df = generate_patient_database(
-            num_patients=args.num_patients,
-            patient_data=patient_data,
-            default_test_date=args.default_test_date,
-        )
+        # Seeded runs of generated data are reproducible, so they can be cached
+        cache_path = None
+        if args.seed is not None and not patient_data:
+            cache_path = get_patient_cache_path(
+                args.num_patients, args.seed, args.default_test_date
+            )
+
+        if cache_path and os.path.isfile(cache_path):
+            logging.info(f"Loading cached patient rows from {cache_path}")
+            patient_rows = read_cached_patient_rows(cache_path)
+        else:
+            # Generate the patient rows
+            patient_rows = generate_patient_rows(
+                num_patients=args.num_patients,
+                patient_data=patient_data,
+                default_test_date=args.default_test_date,
+                seed=args.seed,
+            )
+            if cache_path:
+                patient_rows = cache_patient_rows(patient_rows, cache_path)
 
-        # Save to SQLite database
-        save_to_database(
-            df=patient_df,
-            databases_dir=databases_dir,
+        # Stream the rows into the SQLite database
+        save_patient_rows(
+            rows=patient_rows,
+            databases_dir=DATABASES_DIR,
             database_name=args.database_name,
         )
 
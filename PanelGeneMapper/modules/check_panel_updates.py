@@ -1,77 +1,130 @@
 import os
+import math
 import logging
-import requests
 import pandas as pd
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
+from .panelapp_session import REQUEST_TIMEOUT, SESSION
+from .retrieve_gene_local_db import list_panelapp_dbs, open_sqlite_ro
 
-def get_panel_app_list():
+
+# Project directories, resolved once at import
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+LOGS_DIR = os.path.join(PROJECT_DIR, "logs")
+DATABASES_DIR = os.path.join(PROJECT_DIR, "databases")
+
+# Pages requested at once after the first page reports the total panel count
+PAGE_FETCH_WORKERS = 8
+
+
+def fetch_panel_app_page(url, headers):
     """
-    Queries the Panel App API to return details on all signed-off Panels.
+    Fetch and parse one page of the Panel App API.
+
+    Requests go through the shared PanelApp SESSION, so keep-alive connections
+    and the retry policy are reused across pages and across calls.
+
+    Args:
+        url (str): URL of the page.
+        headers (dict): Headers required for the API request.
 
     Returns:
-        pd.DataFrame: DataFrame containing panel_id and version from the API.
+        dict: The parsed page.
+    """
+    response = SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+    # Handle API errors
+    if not response.ok:
+        response.raise_for_status()
+
+    return response.json()
+
+
+def iter_panel_app_pages():
+    """
+    Queries the Panel App API and yields the results of each page in turn.
+
+    The first page gives the total number of panels, so the remaining pages are
+    requested concurrently and yielded in page order. If the count is missing,
+    the `next` links are followed one page at a time instead.
+
+    Yields:
+        list: Panel records from one page of the API.
     """
     server = "https://panelapp.genomicsengland.co.uk"
     ext = "/api/v1/panels/"
     headers = {"Content-Type": "application/json"}
 
-    # Initial API call
-    response = requests.get(server + ext, headers=headers)
+    url = server + ext
+    payload = fetch_panel_app_page(url, headers)
+    yield payload["results"]
 
-    # Handle API errors
-    if not response.ok:
-        response.raise_for_status()
+    count = payload.get("count")
+    page_size = len(payload["results"])
+    if payload.get("next") is not None and count and page_size:
+        # Request every remaining page at once over the pooled connections
+        page_urls = [f"{url}?page={page}" for page in range(2, math.ceil(count / page_size) + 1)]
+        with ThreadPoolExecutor(max_workers=min(PAGE_FETCH_WORKERS, len(page_urls))) as executor:
+            for page in executor.map(lambda page_url: fetch_panel_app_page(page_url, headers), page_urls):
+                yield page["results"]
+        return
 
-    # Normalize the first page of results
-    panel_app_df = pd.json_normalize(response.json(), record_path=["results"])
-    all_dataframes = [panel_app_df]
+    next_url = payload.get("next")
+    while next_url is not None:
+        payload = fetch_panel_app_page(next_url, headers)
+        yield payload["results"]
+        next_url = payload.get("next")
 
-    # Fetch subsequent pages
-    while response.json().get("next") is not None:
-        response = requests.get(response.json()["next"], headers=headers)
-        next_page_df = pd.json_normalize(response.json(), record_path=["results"])
-        all_dataframes.append(next_page_df)
 
-    # Combine all pages into a single DataFrame
-    panel_app_df = pd.concat(all_dataframes, ignore_index=True)
+def get_panel_app_list():
+    """
+    Queries the Panel App API to return details on all signed-off Panels.
+
+    Returns:
+        pd.DataFrame: DataFrame containing panel_id and version from the API.
+    """
+    # Keep only the two fields needed from each panel, across every page
+    records = [
+        (panel["id"], panel["version"])
+        for results in iter_panel_app_pages()
+        for panel in results
+    ]
 
-    # Return only id and version columns, renamed for clarity
-    return panel_app_df[["id", "version"]].rename(columns={"id": "panel_id"})
+    # Build the DataFrame once from all pages
+    return pd.DataFrame.from_records(records, columns=["panel_id", "version"])
 
 
 def compare_panel_versions():
     """
     Compare panel versions between the latest local database in the databases folder and the PanelApp API.
 
+    Callers can act on the returned flag instead of searching the log for the differences message.
+
     Returns:
-        None
+        bool or None: True if differences were found, False if the local database matches the API,
+        or None if the comparison could not be made.
     """
     try:
-        # Define the databases directory
-        script_dir = os.path.abspath(os.path.dirname(__file__))
-        project_dir = os.path.abspath(os.path.join(script_dir, "..", ".."))
-        databases_dir = os.path.join(project_dir, "databases")
-
-        # Find the latest PanelApp database
-        db_files = [
-            f for f in os.listdir(databases_dir)
-            if f.startswith("panelapp_v") and f.endswith(".db")
-        ]
+        # Find the latest PanelApp database by its version date
+        db_files = list_panelapp_dbs(DATABASES_DIR)
         if not db_files:
             logging.error("No `panelapp_v` database found in the databases directory.")
-            return
+            return None
 
-        # Sort databases by version and select the latest
-        db_files.sort(reverse=True)
         latest_db = db_files[0]
-        db_path = os.path.join(databases_dir, latest_db)
+        db_path = os.path.join(DATABASES_DIR, latest_db)
 
         logging.info(f"Using latest local PanelApp database: {latest_db}")
 
-        # Connect to the local database
-        with sqlite3.connect(db_path) as conn:
-            local_df = pd.read_sql_query("SELECT panel_id, version FROM panel_info", conn)
+        # Read the local database without taking write locks
+        conn = open_sqlite_ro(db_path)
+        try:
+            rows = conn.execute("SELECT DISTINCT panel_id, version FROM panel_info").fetchall()
+        finally:
+            conn.close()
+        local_df = pd.DataFrame.from_records(rows, columns=["panel_id", "version"]).astype(
+            {"panel_id": "int64", "version": "string"}
+        )
 
         logging.info("Retrieved panel data from the local database.")
 
@@ -89,24 +142,26 @@ def compare_panel_versions():
             indicator=True,
         )
 
-        # Find and log differences
-        differences = merged_df[merged_df["_merge"] != "both"]
+        # Find and log panels missing on either side or at a different version
+        version_changed = merged_df["version_local"].astype("string") != merged_df["version_api"].astype("string")
+        differences = merged_df[(merged_df["_merge"] != "both") | version_changed.fillna(False)]
         if not differences.empty:
             logging.warning("Differences found between local and API versions:")
             logging.warning(differences)
-        else:
-            logging.info("No differences found. Local database matches the API.")
+            return True
+
+        logging.info("No differences found. Local database matches the API.")
+        return False
 
     except Exception as e:
         logging.error(f"An error occurred during comparison: {e}")
+        return None
 
 
 if __name__ == "__main__":
     # Configure logging
-    project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-    logs_dir = os.path.join(project_dir, "logs")
-    os.makedirs(logs_dir, exist_ok=True)
-    log_file = os.path.join(logs_dir, "panelapp_comparison.log")
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    log_file = os.path.join(LOGS_DIR, "panelapp_comparison.log")
 
     logging.basicConfig(
         level=logging.INFO,
@@ -3,6 +3,21 @@ import logging
 from logging.handlers import RotatingFileHandler
 
 
+# Environment variable overriding the root log level, e.g. PANELGENEMAPPER_LOG_LEVEL=DEBUG
+LOG_LEVEL_ENV_VAR = "PANELGENEMAPPER_LOG_LEVEL"
+
+
+def get_log_level():
+    """
+    Return the root log level, taken from PANELGENEMAPPER_LOG_LEVEL if set.
+
+    Returns:
+        int: The log level, INFO by default or if the variable is not a valid level name.
+    """
+    level = logging.getLevelName(os.environ.get(LOG_LEVEL_ENV_VAR, "INFO").upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
 def setup_logging(
     logs_dir="logs",
     info_log_file="info.log",
@@ -32,9 +47,10 @@ def setup_logging(
             open(info_log_path, "w").close()
             open(error_log_path, "w").close()
 
-        # Get the root logger
+        # Get the root logger; records below its level are dropped before any formatting
         logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
+        log_level = get_log_level()
+        logger.setLevel(log_level)
 
         # Remove existing handlers to prevent duplication
         while logger.handlers:
@@ -42,9 +58,9 @@ def setup_logging(
 
         # INFO handler with optional rotation
         info_handler = RotatingFileHandler(
-            info_log_path, maxBytes=15 * 1024, backupCount=1
+            info_log_path, maxBytes=1024 * 1024, backupCount=5
         )
-        info_handler.setLevel(logging.INFO)
+        info_handler.setLevel(min(log_level, logging.INFO))
         info_handler.addFilter(lambda record: record.levelno <= logging.INFO)
         info_handler.setFormatter(
             logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
@@ -53,7 +69,7 @@ def setup_logging(
 
         # ERROR handler with optional rotation
         error_handler = RotatingFileHandler(
-            error_log_path, maxBytes=15 * 1024, backupCount=1
+            error_log_path, maxBytes=1024 * 1024, backupCount=5
         )
         error_handler.setLevel(logging.ERROR)
         error_handler.setFormatter(
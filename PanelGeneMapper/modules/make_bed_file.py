@@ -5,16 +5,23 @@ import json
 import logging
 import argparse
 import sqlite3
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from retrieve_gene_local_db import (
-    get_archive_dir,
+from .retrieve_gene_local_db import (
     get_databases_dir,
     connect_and_join_databases,
-    retrieve_latest_panelapp_db,
+    iter_archived_dbs,
+    open_sqlite_ro,
+    remove_temp_file,
+    resolve_panelapp_dbs,
 )
 
 # Set up logging
@@ -33,28 +40,285 @@ from retrieve_gene_local_db import (
 #     datefmt="%Y-%m-%d %H:%M",
 # )
 
-# SQLite database for caching
-output_dir = os.path.join("..", "output")
-os.makedirs(output_dir, exist_ok=True)
-DB_NAME = os.path.join(output_dir, "gene_data.db")
-archive_folder = get_archive_dir()
+# SQLite database for caching, created on first use
+DB_NAME = os.path.join("..", "output", "gene_data.db")
+
+# Shared HTTP session so every Ensembl request reuses pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.headers.update({"Content-Type": "application/json"})
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[500, 502, 503, 504],
+        ),
+    ),
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that paces requests to a rate-limited API.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : int
+        Maximum number of tokens the bucket holds.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, tokens=1):
+        """
+        Block until the requested tokens are available, then take them.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Empty the bucket so no tokens are available for the given number of seconds.
+        """
+        with self.lock:
+            self.tokens = -seconds * self.rate
+            self.updated = time.monotonic()
+
+
+# Ensembl allows 15 requests per second; stay just under it
+ENSEMBL_RATE_LIMITER = TokenBucket(rate=14, capacity=14)
+ENSEMBL_MAX_ATTEMPTS = 3
+
+
+def ensembl_request(method, url, **kwargs):
+    """
+    Send a request to the Ensembl REST API within its rate limit.
+
+    Each request waits for a token from ENSEMBL_RATE_LIMITER. If Ensembl still
+    answers 429, or reports that the limit is exhausted, every thread backs off
+    for exactly as long as the response headers say.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method, e.g. "GET" or "POST".
+    url : str
+        Request URL.
+    **kwargs
+        Passed through to SESSION.request.
+
+    Returns
+    -------
+    requests.Response
+        The Ensembl response.
+    """
+    for _ in range(ENSEMBL_MAX_ATTEMPTS):
+        ENSEMBL_RATE_LIMITER.consume()
+        response = SESSION.request(method, url, **kwargs)
+        if response.status_code != 429:
+            break
+        retry_after = float(response.headers.get("Retry-After", 1))
+        logging.warning(f"Ensembl rate limit reached. Retrying in {retry_after} seconds.")
+        ENSEMBL_RATE_LIMITER.pause(retry_after)
+
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        ENSEMBL_RATE_LIMITER.pause(float(response.headers.get("X-RateLimit-Reset", 1)))
+
+    return response
+
+
+def ensembl_get(url, **kwargs):
+    """
+    Send a rate-limited GET request to the Ensembl REST API.
+    """
+    return ensembl_request("GET", url, **kwargs)
+
+
+def ensembl_post(url, **kwargs):
+    """
+    Send a rate-limited POST request to the Ensembl REST API.
+    """
+    return ensembl_request("POST", url, **kwargs)
+
+
+# Maximum number of IDs Ensembl accepts in one POST /lookup/id request
+ENSEMBL_LOOKUP_BATCH_SIZE = 1000
+
+# Lookup batches in flight at once; the rate limiter still paces every request
+ENSEMBL_LOOKUP_WORKERS = 4
+
+# Compact JSON encoding for cached exon data (no whitespace after separators)
+CACHE_JSON_SEPARATORS = (",", ":")
+
+# Rows read per chunk when extracting IDs from a CSV file
+CSV_CHUNK_SIZE = 100_000
+
+
+# IDs per cache lookup, kept under SQLite's default limit of 999 bound parameters
+CACHE_LOOKUP_CHUNK_SIZE = 900
+
+# Cache statements, compiled once per connection by sqlite3's statement cache
+SELECT_EXON_SQL = "SELECT exon_data FROM gene_exons WHERE gene_id = ?"
+INSERT_EXON_SQL = "INSERT OR REPLACE INTO gene_exons (gene_id, exon_data) VALUES (?, ?)"
+
+# Key in cache_meta recording the Ensembl release the cached exon data came from
+CACHE_RELEASE_KEY = "ensembl_release"
+
+# Key in cache_meta recording the layout of the cached exon data, and the current
+# layout; bump the version whenever the shape or selection of cached records changes
+# (version 1: MANE Select transcript records only)
+CACHE_SCHEMA_KEY = "schema_version"
+CACHE_SCHEMA_VERSION = "1"
+
+# One cache connection per thread; SQLite allows a single writer at a time
+_thread_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def get_cache_connection():
+    """
+    Return the calling thread's connection to the exon cache database.
+
+    The connection is opened on first use and reused for every later lookup
+    or write from the same thread. Writers use it as a context manager so
+    each write commits on success and rolls back on error.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to DB_NAME.
+    """
+    conn = getattr(_thread_local, "conn", None)
+    if conn is None or _thread_local.db_name != DB_NAME:
+        os.makedirs(os.path.dirname(DB_NAME) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        _thread_local.conn = conn
+        _thread_local.db_name = DB_NAME
+    return conn
+
 
 def create_local_db():
     """
     Create a local SQLite database to cache exon data.
+
+    Cached exon data written under a different CACHE_SCHEMA_VERSION, or by a
+    version that did not record one, is discarded.
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS gene_exons (
-            gene_id TEXT PRIMARY KEY,
-            exon_data TEXT
+    conn = get_cache_connection()
+    with _write_lock, conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gene_exons (
+                gene_id TEXT PRIMARY KEY,
+                exon_data TEXT
+            )
+            """
         )
-        """
-    )
-    conn.commit()
-    conn.close()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+            """
+        )
+        row = conn.execute(
+            "SELECT value FROM cache_meta WHERE key = ?", (CACHE_SCHEMA_KEY,)
+        ).fetchone()
+        if row is None or row[0] != CACHE_SCHEMA_VERSION:
+            cleared = conn.execute("DELETE FROM gene_exons").rowcount
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)",
+                (CACHE_SCHEMA_KEY, CACHE_SCHEMA_VERSION),
+            )
+            if cleared:
+                logging.info(f"Exon cache layout changed. Cleared {cleared} cached entries.")
+
+
+def get_ensembl_release(server, headers):
+    """
+    Retrieve the current Ensembl release number from the REST API.
+
+    Parameters
+    ----------
+    server : str
+        Ensembl REST server URL.
+    headers : dict
+        Request headers.
+
+    Returns
+    -------
+    str or None
+        The release number, or None if it could not be retrieved.
+    """
+    try:
+        response = ensembl_get(f"{server}/info/data", headers=headers, timeout=10)
+    except requests.RequestException as e:
+        logging.warning(f"Could not retrieve the Ensembl release: {e}")
+        return None
+
+    if not response.ok:
+        logging.warning(f"Could not retrieve the Ensembl release. Status code: {response.status_code}")
+        return None
+
+    releases = response.json().get("releases", [])
+    return str(max(releases)) if releases else None
+
+
+def sync_cache_release(release):
+    """
+    Empty the exon cache if it was filled from a different Ensembl release.
+
+    Parameters
+    ----------
+    release : str or None
+        Current Ensembl release. If None, the cache is kept as it is.
+
+    Returns
+    -------
+    bool
+        True if cached exon data was discarded, False otherwise.
+    """
+    if release is None:
+        return False
+
+    conn = get_cache_connection()
+    with _write_lock, conn:
+        row = conn.execute(
+            "SELECT value FROM cache_meta WHERE key = ?", (CACHE_RELEASE_KEY,)
+        ).fetchone()
+        if row and row[0] == release:
+            return False
+
+        conn.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES (?, ?)", (CACHE_RELEASE_KEY, release))
+        if row is None:
+            return False
+        conn.execute("DELETE FROM gene_exons")
+
+    logging.info(f"Ensembl release changed from {row[0]} to {release}. Cleared cached exon data.")
+    return True
+
 
 def cache_exon_data(gene_id, exon_data):
     """
@@ -67,14 +331,27 @@ def cache_exon_data(gene_id, exon_data):
     exon_data : str
         Exon data as a JSON string.
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT OR REPLACE INTO gene_exons (gene_id, exon_data) VALUES (?, ?)",
-        (gene_id, exon_data),
-    )
-    conn.commit()
-    conn.close()
+    conn = get_cache_connection()
+    with _write_lock, conn:
+        conn.execute(INSERT_EXON_SQL, (gene_id, exon_data))
+
+
+def cache_exon_data_bulk(rows):
+    """
+    Cache exon data for many genes in a single transaction.
+
+    Parameters
+    ----------
+    rows : list of tuple
+        (gene_id, exon_data) pairs, with exon data as JSON strings.
+    """
+    if not rows:
+        return
+    conn = get_cache_connection()
+    with _write_lock, conn:
+        conn.executemany(INSERT_EXON_SQL, rows)
+    logging.info(f"Cached exon data for {len(rows)} genes.")
+
 
 def fetch_cached_data(gene_id):
     """
@@ -90,13 +367,36 @@ def fetch_cached_data(gene_id):
     str or None
         Cached exon data as a JSON string, or None if not found.
     """
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT exon_data FROM gene_exons WHERE gene_id = ?", (gene_id,))
-    result = cursor.fetchone()
-    conn.close()
+    result = get_cache_connection().execute(SELECT_EXON_SQL, (gene_id,)).fetchone()
     return result[0] if result else None
 
+
+def bulk_fetch_cached(gene_ids):
+    """
+    Fetch cached exon data for many genes with one query per chunk of IDs.
+
+    Parameters
+    ----------
+    gene_ids : list
+        Ensembl gene IDs.
+
+    Returns
+    -------
+    dict
+        Exon data keyed by Ensembl gene ID, for the genes found in the cache.
+    """
+    conn = get_cache_connection()
+    cached = {}
+    for start in range(0, len(gene_ids), CACHE_LOOKUP_CHUNK_SIZE):
+        chunk = gene_ids[start:start + CACHE_LOOKUP_CHUNK_SIZE]
+        rows = conn.execute(
+            f"SELECT gene_id, exon_data FROM gene_exons WHERE gene_id IN ({','.join(['?'] * len(chunk))})",
+            chunk,
+        ).fetchall()
+        cached.update((gene_id, json.loads(exon_data)) for gene_id, exon_data in rows)
+    return cached
+
+
 def extract_ensembl_ids_from_csv(csv_file):
     """
     Extract distinct Ensembl gene IDs from a CSV file.
@@ -115,19 +415,27 @@ def extract_ensembl_ids_from_csv(csv_file):
 
     try:
         logging.info(f"Loading Ensembl gene IDs from CSV file: {csv_file}")
-        df = pd.read_csv(csv_file)
-
-        if "gene_ensembl_id_GRch38" not in df.columns:
-            logging.error("CSV file does not contain the required 'gene_ensembl_id_GRch38' column.")
-            return []
+        # Read only the ID column, a chunk at a time
+        chunks = pd.read_csv(
+            csv_file,
+            usecols=lambda column: column == "gene_ensembl_id_GRch38",
+            dtype={"gene_ensembl_id_GRch38": "category"},
+            chunksize=CSV_CHUNK_SIZE,
+        )
+        with chunks:
+            for chunk in chunks:
+                if "gene_ensembl_id_GRch38" not in chunk.columns:
+                    logging.error("CSV file does not contain the required 'gene_ensembl_id_GRch38' column.")
+                    return []
 
-        ensembl_ids.update(df["gene_ensembl_id_GRch38"].dropna().unique())
+                ensembl_ids.update(chunk["gene_ensembl_id_GRch38"].dropna().unique())
         logging.info(f"Extracted {len(ensembl_ids)} unique Ensembl gene IDs from the CSV file.")
     except Exception as e:
         logging.error(f"An error occurred while extracting Ensembl IDs from the CSV file: {e}")
 
     return list(ensembl_ids)
 
+
 def extract_ensembl_ids_with_join(patient_db=None, r_code=None, patient_id=None):
     """
     Extract distinct Ensembl gene IDs by joining data from patient_database and PanelApp databases.
@@ -154,56 +462,66 @@ def extract_ensembl_ids_with_join(patient_db=None, r_code=None, patient_id=None)
 
     try:
         # Load patient data from the patient database
-        with sqlite3.connect(patient_db) as patient_conn:
-            patient_query = "SELECT DISTINCT clinical_id, panel_retrieved_date FROM patient_data"
-            params = []
-            if r_code:
-                patient_query += " WHERE clinical_id = ?"
-                params.append(r_code)
-            elif patient_id:
-                patient_query += " WHERE patient_id = ?"
-                params.append(patient_id)
-
-            patient_df = pd.read_sql_query(patient_query, patient_conn, params=params)
-
-        if patient_df.empty:
+        patient_query = "SELECT DISTINCT clinical_id, panel_retrieved_date FROM patient_data"
+        params = []
+        if r_code:
+            patient_query += " WHERE clinical_id = ?"
+            params.append(r_code)
+        elif patient_id:
+            patient_query += " WHERE patient_id = ?"
+            params.append(patient_id)
+
+        patient_conn = open_sqlite_ro(patient_db)
+        try:
+            rows = patient_conn.execute(patient_query, params).fetchall()
+        finally:
+            patient_conn.close()
+
+        if not rows:
             logging.warning("No matching patient data found.")
             return list(ensembl_ids)
 
-        # Retrieve unique panel_retrieved_dates
-        unique_dates = patient_df["panel_retrieved_date"].unique()
-
-        for date in unique_dates:
-            # Filter patient data for the current date
-            filtered_patients = patient_df[patient_df["panel_retrieved_date"] == date]["clinical_id"].tolist()
-
-            if not filtered_patients:
-                logging.warning(f"No patients found for date: {date}")
-                continue
-
-            # Construct the expected PanelApp database file path
-            panelapp_file = f"panelapp_v{date.replace('-', '')}.db"
-            panelapp_path = os.path.join(get_databases_dir(), panelapp_file)
-
-            # If the database file is not found, fall back to the archive folder
-            if not os.path.isfile(panelapp_path):
-                logging.info(f"PanelApp database not found in main directory for date: {date}. Checking archive...")
-                panelapp_path, _ = retrieve_latest_panelapp_db(
-                    archive_folder=get_archive_dir(),
-                    panelapp_db=os.path.join(get_databases_dir(), panelapp_file)
-                )
-
-            # Load PanelApp data and perform the join
-            with sqlite3.connect(panelapp_path) as panelapp_conn:
-                query = f"""
-                SELECT DISTINCT gene_ensembl_id_GRch38
-                FROM panel_info
-                WHERE relevant_disorders IN ({",".join(["?"] * len(filtered_patients))})
-                """
-                result = pd.read_sql_query(query, panelapp_conn, params=filtered_patients)
-
-                # Add unique Ensembl IDs to the set
-                ensembl_ids.update(result["gene_ensembl_id_GRch38"].dropna().tolist())
+        # Group clinical IDs by panel_retrieved_date
+        clinical_ids_by_date = defaultdict(list)
+        for clinical_id, date in rows:
+            clinical_ids_by_date[date].append(clinical_id)
+
+        # Resolve each date's PanelApp database, live or archived, as retrieve_genes does
+        clinical_ids_by_db = defaultdict(set)
+        archived_paths = set()
+        for date, _, panelapp_path, archived in resolve_panelapp_dbs(clinical_ids_by_date):
+            clinical_ids_by_db[panelapp_path].update(clinical_ids_by_date[date])
+            if archived:
+                archived_paths.add(panelapp_path)
+
+        # Archives are decompressed to temporary files in the background while earlier
+        # databases are queried
+        db_paths = list(clinical_ids_by_db)
+        archived_dbs = iter_archived_dbs(
+            [path for path in db_paths if path in archived_paths], to_file=True
+        )
+        try:
+            # Open each PanelApp database once and look up all of its clinical IDs together
+            for panelapp_path in db_paths:
+                clinical_ids = list(clinical_ids_by_db[panelapp_path])
+                temp_path = next(archived_dbs) if panelapp_path in archived_paths else None
+                panelapp_conn = open_sqlite_ro(temp_path or panelapp_path)
+                try:
+                    query = f"""
+                    SELECT DISTINCT gene_ensembl_id_GRch38
+                    FROM panel_info
+                    WHERE relevant_disorders IN ({",".join(["?"] * len(clinical_ids))})
+                    """
+                    result = panelapp_conn.execute(query, clinical_ids).fetchall()
+
+                    # Add unique Ensembl IDs to the set
+                    ensembl_ids.update(row[0] for row in result if row[0])
+                finally:
+                    panelapp_conn.close()
+                    if temp_path is not None:
+                        remove_temp_file(temp_path)
+        finally:
+            archived_dbs.close()
 
     except Exception as e:
         logging.error(f"An error occurred during extraction: {e}")
@@ -211,99 +529,196 @@ def extract_ensembl_ids_with_join(patient_db=None, r_code=None, patient_id=None)
     return list(ensembl_ids)
 
 
-def get_mane_exon_data(ensembl_id, species, server, headers):
+def write_bed_file(data_list, output_file):
     """
-    Retrieve MANE Select exon data for a gene using the Ensembl API, with caching.
+    Write MANE Select exons to a BED file, sorted by chromosome and start position.
+
+    Sorted output can be indexed (e.g. with tabix) and overlap-queried by
+    downstream tools without a full scan.
     """
-    # Check the cache first
-    cached_data = fetch_cached_data(ensembl_id)
-    if cached_data:
-        logging.info(f"Cache hit for {ensembl_id}.")
-        return json.loads(cached_data)  # Parse JSON string into a Python dictionary
+    logging.info(f"Writing to BED file {output_file}.")
+    records = []
+    for data in data_list:
+        if not isinstance(data, dict) or "exons" not in data:
+            logging.warning(f"Skipping invalid data entry: {data}")
+            continue
+
+        # Fields shared by every exon of the gene
+        chrom = f"chr{data.get('seq_region_name', 'unknown')}"
+        suffix = (
+            f"{data.get('gene_name', 'unknown')}\t{data.get('gene_id', 'unknown')}\t"
+            f"{data.get('transcript_type', 'unknown')}\n"
+        )
+        records.extend(
+            (chrom, exon.get("start", 0) - 1, exon.get("end", 0), suffix)
+            for exon in data["exons"]
+        )
 
-    url = f"{server}/overlap/id/{ensembl_id}"
-    params = {"feature": "transcript", "species": species}
+    records.sort(key=lambda record: record[:3])
 
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.ok:
-            transcripts = response.json()
-            if not isinstance(transcripts, list):
-                logging.error(f"Unexpected response format for {ensembl_id}: {transcripts}")
-                return None
-
-            for transcript in transcripts:
-                if "MANE_Select" in transcript.get("tag", []):
-                    exon_response = requests.get(
-                        f"{server}/overlap/id/{transcript['id']}",
-                        headers=headers,
-                        params={"feature": "exon"},
-                        timeout=10,
-                    )
-                    if exon_response.ok:
-                        exons = exon_response.json()
-                        if not isinstance(exons, list):
-                            logging.error(f"Unexpected exon data format for {ensembl_id}: {exons}")
-                            return None
-
-                        result = {
-                            "seq_region_name": transcript.get("seq_region_name", "N/A"),
-                            "gene_id": ensembl_id,
-                            "gene_name": transcript.get("external_name", "N/A"),
-                            "transcript_id": transcript["id"],
-                            "transcript_type": "MANE_Select",
-                            "exons": exons,
-                        }
-                        cache_exon_data(ensembl_id, json.dumps(result))
-                        return result
-                    else:
-                        logging.error(f"Failed to fetch exon data for transcript {transcript['id']}: {exon_response.text}")
-        else:
-            logging.error(f"Failed to fetch data for {ensembl_id}. Status code: {response.status_code}, Response: {response.text}")
-    except requests.RequestException as e:
-        logging.error(f"Error fetching data for {ensembl_id}: {e}")
+        with open(output_file, "w") as bed_file:
+            bed_file.write("".join(
+                f"{chrom}\t{start}\t{end}\t{suffix}" for chrom, start, end, suffix in records
+            ))
+    except IOError as e:
+        logging.error(f"Error writing to file {output_file}: {e}")
+
+
+def extract_mane_select(gene):
+    """
+    Build the MANE Select exon record for a gene from an expanded Ensembl lookup.
 
+    Parameters
+    ----------
+    gene : dict
+        Gene object returned by /lookup/id with expand=1 and mane=1.
+
+    Returns
+    -------
+    dict or None
+        MANE Select exon data in the shape write_bed_file expects, or None
+        if the gene has no MANE Select transcript.
+    """
+    for transcript in gene.get("Transcript", []):
+        if any(mane.get("type") == "MANE_Select" for mane in transcript.get("MANE", [])):
+            return {
+                "seq_region_name": transcript.get("seq_region_name", "N/A"),
+                "gene_id": gene["id"],
+                "gene_name": transcript.get("display_name", "N/A"),
+                "transcript_id": transcript["id"],
+                "transcript_type": "MANE_Select",
+                "exons": transcript.get("Exon", []),
+            }
     return None
 
 
-def write_bed_file(data_list, output_file):
+def lookup_mane_exon_batch(batch, species, server, headers):
     """
-    Write MANE Select exons to a BED file.
+    Retrieve MANE Select exon data for one batch of genes with a single Ensembl lookup.
+
+    Parameters
+    ----------
+    batch : list
+        At most ENSEMBL_LOOKUP_BATCH_SIZE Ensembl gene IDs.
+    species : str
+        Species name, e.g. "homo_sapiens".
+    server : str
+        Ensembl REST server URL.
+    headers : dict
+        Request headers.
+
+    Returns
+    -------
+    dict
+        MANE Select exon data keyed by Ensembl gene ID.
     """
-    logging.info(f"Writing to BED file {output_file}.")
+    results = {}
     try:
-        with open(output_file, "w") as bed_file:
-            for data in data_list:
-                if not isinstance(data, dict) or "exons" not in data:
-                    logging.warning(f"Skipping invalid data entry: {data}")
-                    continue
-
-                for exon in data["exons"]:
-                    chrom = f"chr{data.get('seq_region_name', 'unknown')}"
-                    start = exon.get("start", 0) - 1
-                    end = exon.get("end", 0)
-                    gene_name = data.get("gene_name", "unknown")
-                    gene_id = data.get("gene_id", "unknown")
-                    transcript_type = data.get("transcript_type", "unknown")
-                    bed_file.write(f"{chrom}\t{start}\t{end}\t{gene_name}\t{gene_id}\t{transcript_type}\n")
-    except IOError as e:
-        logging.error(f"Error writing to file {output_file}: {e}")
+        response = ensembl_post(
+            f"{server}/lookup/id",
+            headers=headers,
+            params={"species": species, "expand": 1, "mane": 1},
+            json={"ids": batch},
+            timeout=60,
+        )
+    except requests.RequestException as e:
+        logging.error(f"Error fetching data for {len(batch)} genes: {e}")
+        return results
+
+    if not response.ok:
+        logging.error(f"Failed to fetch data for {len(batch)} genes. Status code: {response.status_code}, Response: {response.text}")
+        return results
+
+    genes = response.json()
+    for ensembl_id in batch:
+        gene = genes.get(ensembl_id)
+        if not gene:
+            logging.error(f"No Ensembl data returned for {ensembl_id}.")
+            continue
+
+        result = extract_mane_select(gene)
+        if result:
+            results[ensembl_id] = result
+        else:
+            logging.warning(f"No MANE Select transcript found for {ensembl_id}.")
+
+    return results
+
+
+def lookup_mane_exon_data(gene_ids, species, server, headers):
+    """
+    Retrieve MANE Select exon data for many genes with batched Ensembl lookups.
+
+    Genes are sent to POST /lookup/id in groups of ENSEMBL_LOOKUP_BATCH_SIZE,
+    and each response already contains every transcript and exon, so no
+    per-gene or per-transcript requests are needed. Up to
+    ENSEMBL_LOOKUP_WORKERS batches are in flight at once.
+
+    Parameters
+    ----------
+    gene_ids : list
+        Ensembl gene IDs.
+    species : str
+        Species name, e.g. "homo_sapiens".
+    server : str
+        Ensembl REST server URL.
+    headers : dict
+        Request headers.
+
+    Returns
+    -------
+    dict
+        MANE Select exon data keyed by Ensembl gene ID.
+    """
+    batches = [
+        gene_ids[start:start + ENSEMBL_LOOKUP_BATCH_SIZE]
+        for start in range(0, len(gene_ids), ENSEMBL_LOOKUP_BATCH_SIZE)
+    ]
+    if len(batches) <= 1:
+        return lookup_mane_exon_batch(batches[0], species, server, headers) if batches else {}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(ENSEMBL_LOOKUP_WORKERS, len(batches))) as executor:
+        for batch_results in executor.map(
+            lambda batch: lookup_mane_exon_batch(batch, species, server, headers), batches
+        ):
+            results.update(batch_results)
+
+    return results
 
 
 def fetch_all_data(gene_ids, species, server, headers):
     """
-    Fetch MANE Select exon data for multiple genes using multithreading.
+    Fetch MANE Select exon data for multiple genes.
+
+    Genes already in the local cache are read from it in a few chunked
+    queries; the rest are fetched with batched Ensembl lookups and cached in
+    one transaction. The cache is emptied first if Ensembl has published a
+    new release since it was filled.
     """
+    sync_cache_release(get_ensembl_release(server, headers))
+    cached = bulk_fetch_cached(list(gene_ids))
     results = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [
-            executor.submit(get_mane_exon_data, ensembl_id, species, server, headers)
-            for ensembl_id in gene_ids
+    to_fetch = []
+    for ensembl_id in gene_ids:
+        if ensembl_id in cached:
+            results.append(cached[ensembl_id])
+        else:
+            to_fetch.append(ensembl_id)
+    logging.info(f"{len(results)} genes found in cache, {len(to_fetch)} to fetch from Ensembl.")
+
+    fetched = lookup_mane_exon_data(to_fetch, species, server, headers)
+    results.extend(fetched.values())
+
+    # Write every newly fetched gene to the cache in one transaction
+    cache_exon_data_bulk(
+        [
+            (ensembl_id, json.dumps(result, separators=CACHE_JSON_SEPARATORS))
+            for ensembl_id, result in fetched.items()
         ]
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                results.append(result)
+    )
+
     return results
 
 # def main():
@@ -0,0 +1,22 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Seconds to wait for a PanelApp response before giving up on a request
+REQUEST_TIMEOUT = 10
+
+# Shared HTTP session so every PanelApp request reuses pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
@@ -1,13 +1,23 @@
 import os
+import csv
+import functools
 import logging
 import sqlite3
-import pandas as pd
 
+from .retrieve_gene_local_db import list_panelapp_dbs, open_sqlite_ro, panelapp_version_date
 
+# Rows read from the patient database per logged block when listing patients
+LIST_FETCH_SIZE = 10_000
+
+# Columns of the patient_data table, in insert order
+PATIENT_COLUMNS = ("patient_id", "clinical_id", "test_date", "panel_retrieved_date")
+
+
+@functools.lru_cache(maxsize=1)
 def get_databases_dir():
     """
     Get the path to the databases directory two levels up from the script location.
-    Ensures the directory exists.
+    Ensures the directory exists. The path is computed once per process.
 
     Returns:
         str: Path to the databases directory.
@@ -30,32 +40,45 @@ def list_patients(patient_db="patient_database.db", save_to_file=False):
     databases_dir = get_databases_dir()
     patient_db_path = os.path.join(databases_dir, patient_db)
     conn = None
+    output = None
 
     try:
         if not os.path.isfile(patient_db_path):
             logging.error(f"Patient database not found at {patient_db_path}.")
             return
 
-        conn = sqlite3.connect(patient_db_path)
-        query = "SELECT DISTINCT patient_id, clinical_id FROM patient_data"
-        df = pd.read_sql_query(query, conn)
-
-        if df.empty:
+        conn = open_sqlite_ro(patient_db_path)
+        cursor = conn.execute("SELECT DISTINCT patient_id, clinical_id FROM patient_data")
+
+        # Stream the rows in blocks rather than loading every patient at once
+        writer = None
+        listed = False
+        for rows in iter(lambda: cursor.fetchmany(LIST_FETCH_SIZE), []):
+            if not listed:
+                logging.info("Listing all patients and their clinical IDs:")
+                logging.info("patient_id\tclinical_id")
+                if save_to_file:
+                    output_dir = os.path.join(databases_dir, "output")
+                    os.makedirs(output_dir, exist_ok=True)
+                    output = open(os.path.join(output_dir, "patient_list.csv"), "w", newline="")
+                    writer = csv.writer(output, lineterminator=os.linesep)
+                    writer.writerow(["patient_id", "clinical_id"])
+                listed = True
+
+            logging.info("\n".join(f"{patient_id}\t{clinical_id}" for patient_id, clinical_id in rows))
+            if writer is not None:
+                writer.writerows(rows)
+
+        if not listed:
             logging.info("No patients found in the database.")
-        else:
-            logging.info("Listing all patients and their clinical IDs:")
-            logging.info(df)
-
-            if save_to_file:
-                output_dir = os.path.join(databases_dir, "output")
-                os.makedirs(output_dir, exist_ok=True)
-                output_path = os.path.join(output_dir, "patient_list.csv")
-                df.to_csv(output_path, index=False)
-                logging.info(f"Patient list saved to {output_path}")
+        elif output is not None:
+            logging.info(f"Patient list saved to {output.name}")
 
     except sqlite3.Error as e:
         logging.error(f"An error occurred while listing patients: {e}")
     finally:
+        if output is not None:
+            output.close()
         if conn:
             conn.close()
 
@@ -75,40 +98,32 @@ def add_patient(patient_id, clinical_id, test_date):
 
         logging.info(f"Adding patient: {patient_id}, R code: {clinical_id}, Test date: {test_date}")
 
-        with sqlite3.connect(patient_db) as conn:
-            existing_patients = pd.read_sql_query("SELECT patient_id FROM patient_data", conn)
+        # Look up just this patient rather than loading every patient ID
+        conn = sqlite3.connect(patient_db)
+        try:
+            patient_exists = conn.execute(
+                "SELECT 1 FROM patient_data WHERE patient_id = ? LIMIT 1", (patient_id,)
+            ).fetchone()
+        finally:
+            conn.close()
 
-        if patient_id in existing_patients["patient_id"].values:
+        if patient_exists:
             logging.warning(
                 f"Patient {patient_id} already exists in the database. Patient was not added."
             )
             return
 
-        db_files = [
-            f for f in os.listdir(databases_dir) if f.startswith("panelapp_v") and f.endswith(".db")
-        ]
+        db_files = list_panelapp_dbs(databases_dir)
         if not db_files:
             raise FileNotFoundError(
                 f"No `panelapp_v` database found in the databases directory: {databases_dir}"
             )
 
-        db_files.sort(reverse=True)
-        latest_file = os.path.join(databases_dir, db_files[0])
+        panel_retrieved_date = panelapp_version_date(db_files[0]).strftime("%Y-%m-%d")
 
-        version_date = latest_file.split("panelapp_v")[1].split(".")[0]
-        panel_retrieved_date = f"{version_date[:4]}-{version_date[4:6]}-{version_date[6:]}"
-
-        new_patient_data = [
-            {
-                "patient_id": patient_id,
-                "clinical_id": clinical_id,
-                "test_date": test_date,
-                "panel_retrieved_date": panel_retrieved_date,
-            }
-        ]
-        patient_df = pd.DataFrame(new_patient_data)
-
-        save_to_database(patient_df, databases_dir, database_name="patient_database.db")
+        add_patients_bulk(
+            [(patient_id, clinical_id, test_date, panel_retrieved_date)], databases_dir
+        )
         logging.info(f"Patient {patient_id} successfully added to the database.")
 
     except FileNotFoundError as e:
@@ -118,12 +133,12 @@ def add_patient(patient_id, clinical_id, test_date):
         raise
 
 
-def save_to_database(df, databases_dir, database_name="patient_database.db", table_name="patient_data"):
+def add_patients_bulk(rows, databases_dir, database_name="patient_database.db", table_name="patient_data"):
     """
-    Save the DataFrame to an SQLite database in the databases directory.
+    Insert patient rows into the patient database with one prepared statement in a single transaction.
 
     Args:
-        df (pd.DataFrame): DataFrame to save.
+        rows (iterable): Tuples of (patient_id, clinical_id, test_date, panel_retrieved_date).
         databases_dir (str): Path to the databases directory.
         database_name (str): Name of the SQLite database file.
         table_name (str): Name of the table in the database.
@@ -136,12 +151,23 @@ def save_to_database(df, databases_dir, database_name="patient_database.db", tab
             logging.error(f"Database file not found at {database_path}.")
             raise FileNotFoundError(f"Database file not found at {database_path}.")
 
-        with sqlite3.connect(database_path) as conn:
+        placeholders = ", ".join(["?"] * len(PATIENT_COLUMNS))
+        insert_sql = f"INSERT INTO {table_name} ({', '.join(PATIENT_COLUMNS)}) VALUES ({placeholders})"
+
+        conn = sqlite3.connect(database_path)
+        try:
             logging.info(f"Connected to database '{database_path}'.")
-            df.to_sql(table_name, conn, if_exists="append", index=False)
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA temp_store = MEMORY")
+
+            # Insert every row with one prepared statement in a single transaction
+            with conn:
+                conn.executemany(insert_sql, rows)
             logging.info(
                 f"Data successfully added to table '{table_name}' in '{database_path}'."
             )
+        finally:
+            conn.close()
 
     except Exception as e:
         logging.error(f"An error occurred while saving to the database: {e}")
@@ -1,15 +1,46 @@
 import os
+import csv
+import atexit
 import logging
 import sqlite3
-import pandas as pd
 import shutil
 import gzip
+import struct
+import tempfile
+import functools
+import urllib.request
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 
+# Buffer size used when decompressing archived databases
+DECOMPRESS_BUFFER_SIZE = 1024 * 1024
+
+# Connection settings for read-heavy queries: memory-mapped I/O (256 MiB),
+# a 64 MiB page cache and in-memory temporary tables
+READ_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# RAM-backed filesystem preferred for decompressed archives when it has room (Linux)
+RAMDISK_DIR = "/dev/shm"
+
+# sqlite3.Connection.deserialize is only available on Python 3.11+; older versions
+# attach archived databases from temporary files instead
+CAN_DESERIALIZE = hasattr(sqlite3.Connection, "deserialize")
+
+# Archived databases decompressed ahead of the one currently being joined
+ARCHIVE_PREFETCH = 2
+
+
+@functools.lru_cache(maxsize=1)
 def get_databases_dir():
     """
     Get the path to the databases directory two levels up from the script location.
-    Ensures the directory exists.
+    Ensures the directory exists. The path is computed once per process.
 
     Returns:
         str: Path to the databases directory.
@@ -21,10 +52,11 @@ def get_databases_dir():
     return databases_dir
 
 
+@functools.lru_cache(maxsize=1)
 def get_archive_dir():
     """
     Get the path to the archive_databases directory two levels up from the script location.
-    Ensures the directory exists.
+    Ensures the directory exists. The path is computed once per process.
 
     Returns:
         str: Path to the archive_databases directory.
@@ -37,6 +69,240 @@ def get_archive_dir():
     return archive_dir
 
 
+def panelapp_version_date(file_name):
+    """
+    Parse the version date from a PanelApp database file name.
+
+    Args:
+        file_name (str): File name such as "panelapp_v20241220.db" or "panelapp_v20241220.db.gz".
+
+    Returns:
+        datetime or None: The version date, or None if the name does not contain a valid date.
+    """
+    try:
+        return datetime.strptime(file_name[len("panelapp_v"):][:8], "%Y%m%d")
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def _scan_panelapp_dbs(directory, suffix, mtime_ns):
+    """
+    Scan a directory for PanelApp database files. Cached per directory modification time.
+
+    Args:
+        directory (str): Directory to scan.
+        suffix (str): File suffix to match.
+        mtime_ns (int): Modification time of the directory, used to invalidate the cache.
+
+    Returns:
+        tuple: Matching file names, newest version date first.
+    """
+    dated = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith("panelapp_v") and entry.name.endswith(suffix):
+                version_date = panelapp_version_date(entry.name)
+                if version_date is not None:
+                    dated.append((version_date, entry.name))
+    return tuple(name for _, name in sorted(dated, reverse=True))
+
+
+def list_panelapp_dbs(directory, suffix=".db"):
+    """
+    List the PanelApp database files in a directory, newest version first.
+
+    Files are ordered by the version date parsed from their names; names without a
+    valid date are ignored. The listing is reused until a file is added to or removed
+    from the directory.
+
+    Args:
+        directory (str): Directory to scan.
+        suffix (str): File suffix to match, e.g. ".db" or ".db.gz". Defaults to ".db".
+
+    Returns:
+        tuple: Matching file names, newest version first.
+    """
+    return _scan_panelapp_dbs(directory, suffix, os.stat(directory).st_mtime_ns)
+
+
+def remove_temp_file(path):
+    """
+    Remove a temporary file if it still exists.
+
+    Args:
+        path (str): Path to the file.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_extract_dir(archive_path):
+    """
+    Choose where to decompress an archived database.
+
+    The RAM-backed RAMDISK_DIR is used when it exists, is writable and has room for the
+    decompressed database, so SQLite reads it without touching the disk. Otherwise the
+    system temporary directory is used.
+
+    Args:
+        archive_path (str): Path to the .db.gz archive.
+
+    Returns:
+        str or None: RAMDISK_DIR, or None for the system temporary directory.
+    """
+    if not (os.path.isdir(RAMDISK_DIR) and os.access(RAMDISK_DIR, os.W_OK)):
+        return None
+
+    try:
+        # The gzip trailer records the decompressed size (modulo 4 GiB)
+        with open(archive_path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            decompressed_size = struct.unpack("<I", f.read(4))[0]
+        free_space = shutil.disk_usage(RAMDISK_DIR).free
+    except OSError:
+        return None
+
+    return RAMDISK_DIR if decompressed_size < free_space else None
+
+
+def extract_archived_db(archive_path, dest_dir=None):
+    """
+    Decompress an archived PanelApp database into a temporary file.
+
+    Args:
+        archive_path (str): Path to the .db.gz archive.
+        dest_dir (str, optional): Directory for the temporary file. Defaults to the directory
+            chosen by get_extract_dir.
+
+    Returns:
+        str: Path to the decompressed database. The caller should remove it once done;
+        any copy left behind is removed when the process exits.
+    """
+    if dest_dir is None:
+        dest_dir = get_extract_dir(archive_path)
+
+    with tempfile.NamedTemporaryFile(delete=False, prefix="panelapp_", suffix=".db", dir=dest_dir) as f_out:
+        try:
+            # Buffer the compressed reads too; gzip otherwise reads the file in small blocks
+            with open(archive_path, "rb", buffering=DECOMPRESS_BUFFER_SIZE) as raw, \
+                    gzip.GzipFile(fileobj=raw, mode="rb") as f_in:
+                shutil.copyfileobj(f_in, f_out, length=DECOMPRESS_BUFFER_SIZE)
+        except Exception:
+            f_out.close()
+            os.remove(f_out.name)
+            raise
+    atexit.register(remove_temp_file, f_out.name)
+    return f_out.name
+
+
+def apply_read_pragmas(conn, schema="main"):
+    """
+    Tune a connection for read-heavy queries with READ_PRAGMAS.
+
+    Args:
+        conn (sqlite3.Connection): Connection to tune.
+        schema (str): Schema name of the (possibly attached) database. Defaults to "main".
+
+    Returns:
+        sqlite3.Connection: The same connection.
+    """
+    for pragma, value in READ_PRAGMAS.items():
+        # temp_store applies to the whole connection rather than to one schema
+        prefix = "" if pragma == "temp_store" else f"{schema}."
+        conn.execute(f"PRAGMA {prefix}{pragma} = {value}")
+    return conn
+
+
+def _sqlite_ro_uri(path):
+    """
+    Build a read-only SQLite URI for a database file.
+
+    Args:
+        path (str): Path to the database file.
+
+    Returns:
+        str: URI that opens the file with mode=ro.
+    """
+    return f"file:{urllib.request.pathname2url(os.path.abspath(path))}?mode=ro"
+
+
+def open_sqlite_ro(path):
+    """
+    Open an SQLite database read-only, tuned for read-heavy queries.
+
+    Databases attached to the connection by URI are read-only too when given
+    the same mode=ro URI.
+
+    Args:
+        path (str): Path to the database file.
+
+    Returns:
+        sqlite3.Connection: Read-only connection to the database.
+
+    Raises:
+        sqlite3.OperationalError: If the database file does not exist.
+    """
+    return apply_read_pragmas(sqlite3.connect(_sqlite_ro_uri(path), uri=True))
+
+
+def read_archived_db(archive_path):
+    """
+    Decompress an archived PanelApp database into memory.
+
+    Args:
+        archive_path (str): Path to the .db.gz archive.
+
+    Returns:
+        bytes: The database file contents, ready for sqlite3.Connection.deserialize.
+    """
+    with open(archive_path, "rb", buffering=DECOMPRESS_BUFFER_SIZE) as raw, \
+            gzip.GzipFile(fileobj=raw, mode="rb") as f_in:
+        return f_in.read()
+
+
+def iter_archived_dbs(archive_paths, prefetch=ARCHIVE_PREFETCH, to_file=False):
+    """
+    Decompress archived PanelApp databases in order, working ahead in a background thread.
+
+    While the caller uses one database, up to `prefetch` of the following
+    archives are decompressed, so decompression overlaps with the caller's queries.
+    If the caller stops early, archives not started yet are skipped and any
+    temporary files it never received are removed.
+
+    Args:
+        archive_paths (list): Paths to .db.gz archives, in the order they are needed.
+        prefetch (int): Number of archives to decompress ahead. Defaults to ARCHIVE_PREFETCH.
+        to_file (bool): Decompress into temporary files with extract_archived_db instead of
+            into memory. The caller removes each file it receives. Defaults to False.
+
+    Yields:
+        bytes or str: The contents of each database, as returned by read_archived_db,
+        or the path of its temporary copy if `to_file` is True.
+    """
+    load = extract_archived_db if to_file else read_archived_db
+    paths = iter(archive_paths)
+    executor = ThreadPoolExecutor(max_workers=1)
+    futures = deque()
+    try:
+        futures.extend(executor.submit(load, path) for _, path in zip(range(prefetch), paths))
+        while futures:
+            data = futures.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                futures.append(executor.submit(load, next_path))
+            yield data
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if to_file:
+            # Remove copies decompressed ahead that were never handed to the caller
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    remove_temp_file(future.result())
+
+
 def retrieve_latest_panelapp_db(archive_folder=None, panelapp_db=None):
     """
     Retrieve the latest PanelApp database from the databases directory or archive folder.
@@ -50,33 +316,22 @@ def retrieve_latest_panelapp_db(archive_folder=None, panelapp_db=None):
     """
     try:
         databases_dir = get_databases_dir()
-        archive_dir = get_archive_dir()
+        archive_dir = archive_folder or get_archive_dir()
 
         if panelapp_db and os.path.isfile(panelapp_db):
             return panelapp_db, False
 
         # Check for the latest database in the databases directory
-        db_files = [
-            f for f in os.listdir(databases_dir)
-            if f.startswith("panelapp_v") and f.endswith(".db")
-        ]
+        db_files = list_panelapp_dbs(databases_dir)
         if db_files:
-            db_files.sort(reverse=True)
             return os.path.join(databases_dir, db_files[0]), False
 
         # Check for the latest database in the archive folder
-        archived_files = [
-            f for f in os.listdir(archive_dir)
-            if f.startswith("panelapp_v") and f.endswith(".db.gz")
-        ]
+        archived_files = list_panelapp_dbs(archive_dir, suffix=".db.gz")
         if archived_files:
-            archived_files.sort(reverse=True)
             latest_archived = archived_files[0]
 
-            temp_file = f"/tmp/{latest_archived.replace('.gz', '')}"
-            with gzip.open(os.path.join(archive_folder, latest_archived), "rb") as f_in:
-                with open(temp_file, "wb") as f_out:
-                    shutil.copyfileobj(f_in, f_out)
+            temp_file = extract_archived_db(os.path.join(archive_dir, latest_archived))
 
             return temp_file, True
 
@@ -87,6 +342,60 @@ def retrieve_latest_panelapp_db(archive_folder=None, panelapp_db=None):
         raise
 
 
+def resolve_panelapp_dbs(dates, archive_folder=None):
+    """
+    Find the PanelApp database retrieved on each date, live or archived.
+
+    A live database in the databases directory is preferred over its archived
+    copy. Dates with neither are logged and skipped.
+
+    Args:
+        dates (iterable): Panel retrieval dates, e.g. '2024-12-20'.
+        archive_folder (str, optional): Path to the archive folder. If not provided, it uses the default.
+
+    Returns:
+        list: (date, file name, path, archived) tuples, in the order of `dates`. `archived`
+        is True when the path is a .db.gz archive.
+    """
+    databases_dir = get_databases_dir()
+    archive_dir = archive_folder or get_archive_dir()
+    sources = []
+    for date in dates:
+        panelapp_file = f"panelapp_v{date.replace('-', '')}.db"
+        panelapp_path = os.path.join(databases_dir, panelapp_file)
+        panelapp_path_gz = os.path.join(archive_dir, f"{panelapp_file}.gz")
+
+        if os.path.isfile(panelapp_path):
+            sources.append((date, panelapp_file, panelapp_path, False))
+        elif os.path.isfile(panelapp_path_gz):
+            sources.append((date, panelapp_file, panelapp_path_gz, True))
+        else:
+            logging.error(f"No PanelApp database found for date: {date}")
+    return sources
+
+
+# Columns written to the gene list CSV, in output order
+GENE_LIST_COLUMNS = [
+    "patient_id", "clinical_id", "test_date", "panel_retrieved_date",
+    "disease_name", "version", "version_created", "panel_r_code",
+    "hgnc_symbol", "hgnc_id", "gene_ensembl_id_GRch38",
+]
+
+# Join of patient_data to the PanelApp panel_info table attached as "panelapp"
+JOIN_QUERY = """
+    SELECT p.patient_id, p.clinical_id, p.test_date, p.panel_retrieved_date,
+           pi.name AS disease_name, pi.version, pi.version_created,
+           pi.relevant_disorders AS panel_r_code, pi.hgnc_symbol, pi.hgnc_id,
+           pi.gene_ensembl_id_GRch38
+    FROM patient_data AS p
+    JOIN panelapp.panel_info AS pi ON p.clinical_id = pi.relevant_disorders
+    WHERE p.panel_retrieved_date = ?
+"""
+
+# Rows fetched from SQLite per CSV write
+FETCH_SIZE = 10_000
+
+
 def connect_and_join_databases(
     patient_db,
     panelapp_db=None,
@@ -100,95 +409,111 @@ def connect_and_join_databases(
     Connects to the patient and PanelApp databases, joins them on clinical_id/relevant_disorders,
     and writes the resulting table to a CSV file.
 
+    Each PanelApp database is attached to the patient connection so SQLite
+    performs the join, and the joined rows are streamed straight to the CSV.
+
     Args:
         patient_db (str): Path to the patient database.
         panelapp_db (str, optional): Path to the PanelApp database. If not provided, it retrieves the latest.
         output_file (str): Path to save the resulting table as CSV.
         r_code (str, optional): The R code (clinical_id) to filter and retrieve data for.
         patient_id (str, optional): The patient ID to filter and retrieve data for.
-        archive_folder (str, optional): Path to the archive folder.
+        archive_folder (str, optional): Path to the archive folder. If not provided, it uses the default.
         specific_date (str, optional): Process only the specified panel_retrieved_date (e.g., '2024-12-20').
     """
+    output = None
+    patient_conn = None
+    archived_dbs = None
     try:
         if not os.path.isfile(patient_db):
             raise FileNotFoundError(f"Patient database not found: {patient_db}")
 
-        patient_conn = sqlite3.connect(patient_db)
+        # Only read here; the indexes the join uses are created when the databases are built
+        patient_conn = open_sqlite_ro(patient_db)
 
-        # Construct patient query
-        patient_query = "SELECT * FROM patient_data"
-        params = []
+        # Construct the patient filter shared by the date lookup and the join
+        patient_filter = ""
+        filter_params = []
         if r_code:
-            patient_query += " WHERE clinical_id = ?"
-            params.append(r_code)
+            patient_filter = " AND p.clinical_id = ?"
+            filter_params.append(r_code)
         elif patient_id:
-            patient_query += " WHERE patient_id = ?"
-            params.append(patient_id)
+            patient_filter = " AND p.patient_id = ?"
+            filter_params.append(patient_id)
 
-        patient_df = pd.read_sql_query(patient_query, patient_conn, params=params)
-        if patient_df.empty:
-            logging.warning("No matching patient data found.")
-            return
-
-        # Filter dates if a specific date is provided
-        unique_dates = patient_df["panel_retrieved_date"].unique()
+        # Restrict the date lookup to the specific date, if provided
+        date_filter = ""
+        date_params = []
         if specific_date:
-            unique_dates = [d for d in unique_dates if d == specific_date]
-            if not unique_dates:
+            date_filter = " AND p.panel_retrieved_date = ?"
+            date_params.append(specific_date)
+
+        unique_dates = [
+            row[0] for row in patient_conn.execute(
+                f"SELECT DISTINCT p.panel_retrieved_date FROM patient_data AS p WHERE 1 = 1{patient_filter}{date_filter}",
+                filter_params + date_params,
+            )
+        ]
+        if not unique_dates:
+            if specific_date:
                 logging.warning(f"No data found for specific date: {specific_date}")
-                return
-
-        result_df = pd.DataFrame()
-        for date in unique_dates:
-            panelapp_file = f"panelapp_v{date.replace('-', '')}.db"
-            panelapp_path = os.path.join(get_databases_dir(), panelapp_file)
-            panelapp_path_gz = os.path.join(get_archive_dir(), f"{panelapp_file}.gz")
-            is_temp = False
-
-            if os.path.isfile(panelapp_path_gz):
-                with gzip.open(panelapp_path_gz, "rb") as f_in:
-                    with open(panelapp_path, "wb") as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                is_temp = True
+            else:
+                logging.warning("No matching patient data found.")
+            return
 
-            if not os.path.isfile(panelapp_path):
-                logging.error(f"No PanelApp database found for date: {date}")
-                continue
+        # Resolve each date's PanelApp database, live or archived
+        sources = resolve_panelapp_dbs(unique_dates, archive_folder)
+
+        # Archives are decompressed in the background while earlier dates are joined
+        archived_dbs = iter_archived_dbs(
+            [path for _, _, path, archived in sources if archived], to_file=not CAN_DESERIALIZE
+        )
+
+        writer = None
+        for date, panelapp_file, panelapp_path, archived in sources:
+            temp_path = None
+            if archived and CAN_DESERIALIZE:
+                # Load archived databases straight into memory rather than a temporary file
+                patient_conn.execute("ATTACH DATABASE ':memory:' AS panelapp")
+                patient_conn.deserialize(next(archived_dbs), name="panelapp")
+            else:
+                if archived:
+                    temp_path = next(archived_dbs)
+                patient_conn.execute(
+                    "ATTACH DATABASE ? AS panelapp", (_sqlite_ro_uri(temp_path or panelapp_path),)
+                )
+                apply_read_pragmas(patient_conn, schema="panelapp")
 
             try:
-                with sqlite3.connect(panelapp_path) as panelapp_conn:
-                    panelapp_df = pd.read_sql_query("SELECT * FROM panel_info", panelapp_conn)
-
-                patient_subset = patient_df[patient_df["panel_retrieved_date"] == date]
-                joined_df = pd.merge(
-                    patient_subset,
-                    panelapp_df,
-                    left_on="clinical_id",
-                    right_on="relevant_disorders",
-                    how="inner",
-                )
-                result_df = pd.concat([result_df, joined_df], ignore_index=True)
+                # Same SQL text every date, so sqlite3 reuses the prepared statement
+                cursor = patient_conn.execute(JOIN_QUERY + patient_filter, [date, *filter_params])
+                for rows in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+                    if writer is None:
+                        output_dir = os.path.dirname(output_file)
+                        if output_dir:
+                            os.makedirs(output_dir, exist_ok=True)
+                        output = open(output_file, "w", newline="")
+                        writer = csv.writer(output, lineterminator=os.linesep)
+                        writer.writerow(GENE_LIST_COLUMNS)
+                    writer.writerows(rows)
+                cursor.close()
             finally:
-                if is_temp:
-                    os.remove(panelapp_path)
+                patient_conn.execute("DETACH DATABASE panelapp")
+                if temp_path is not None:
+                    remove_temp_file(temp_path)
 
-        if result_df.empty:
+        if writer is None:
             logging.warning("No matching data found in PanelApp for the given criteria.")
             return
 
-        result_df = result_df.rename(columns={
-            "name": "disease_name",
-            "relevant_disorders": "panel_r_code"
-        })[[
-            "patient_id", "clinical_id", "test_date", "panel_retrieved_date",
-            "disease_name", "version", "version_created", "panel_r_code",
-            "hgnc_symbol", "hgnc_id", "gene_ensembl_id_GRch38"
-        ]]
-
-        output_dir = os.path.dirname(output_file)
-        os.makedirs(output_dir, exist_ok=True)
-        result_df.to_csv(output_file, index=False)
         logging.info(f"Joined table saved to {output_file}")
 
     except Exception as e:
         logging.error(f"An error occurred: {e}")
+    finally:
+        if archived_dbs is not None:
+            archived_dbs.close()
+        if output is not None:
+            output.close()
+        if patient_conn is not None:
+            patient_conn.close()
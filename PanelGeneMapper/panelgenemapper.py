@@ -3,24 +3,10 @@ import logging
 import os
 
 from modules.custom_logging import setup_logging
-from modules.build_panelApp_database import main as update_database
-from modules.patient_db_lookup_add import (
-    add_patient,
-    list_patients,
-    get_databases_dir,
-)
-from modules.retrieve_gene_local_db import (
-    connect_and_join_databases,
-    retrieve_latest_panelapp_db,
-)
-from modules.check_panel_updates import compare_panel_versions
-from modules.make_bed_file import (
-    create_local_db,
-    extract_ensembl_ids_from_csv,
-    extract_ensembl_ids_with_join,
-    write_bed_file,
-    fetch_all_data,
-)
+from modules.retrieve_gene_local_db import get_databases_dir
+
+# Command modules are imported in main() when their command runs, so commands
+# that do not need pandas or requests do not pay for importing them
 
 
 def configure_logging():
@@ -165,6 +151,14 @@ def generate_bed(args):
     """
     Generate a BED file based on Ensembl gene IDs retrieved from the patient database.
     """
+    from modules.make_bed_file import (
+        create_local_db,
+        extract_ensembl_ids_from_csv,
+        extract_ensembl_ids_with_join,
+        write_bed_file,
+        fetch_all_data,
+    )
+
     logging.info("Generating BED file for the patient database")
 
     # Define species and API details
@@ -201,18 +195,29 @@ def main():
 
     try:
         if args.command == "update":
+            from modules.build_panelApp_database import main as update_database
+
             update_database()
             logging.info("Local PanelApp database updated successfully.")
 
         elif args.command == "list_patients":
+            from modules.patient_db_lookup_add import list_patients
+
             logging.info(f"Listing patients from database: {args.patient_db}")
             list_patients(args.patient_db, save_to_file=args.save)
 
         elif args.command == "add_patient":
+            from modules.patient_db_lookup_add import add_patient
+
             logging.info(f"Adding patient {args.patient_id} to database: {args.patient_db}")
             add_patient(args.patient_id, args.clinical_id, args.test_date)
 
         elif args.command == "retrieve_genes":
+            from modules.retrieve_gene_local_db import (
+                connect_and_join_databases,
+                retrieve_latest_panelapp_db,
+            )
+
             logging.info(f"Retrieving genes for patient database: {args.patient_db}")
             panelapp_db_path, is_temp = retrieve_latest_panelapp_db(args.archive_folder, args.panelapp_db)
             connect_and_join_databases(
@@ -227,6 +232,8 @@ def main():
                 os.remove(panelapp_db_path)
 
         elif args.command == "compare_with_api":
+            from modules.check_panel_updates import compare_panel_versions
+
             logging.info("Comparing local PanelApp database with API.")
             compare_panel_versions()
 
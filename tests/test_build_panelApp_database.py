@@ -15,6 +15,8 @@ from PanelGeneMapper.modules.build_panelApp_database import (
     process_panel_data,
     format_data,
     save_to_database,
+    SESSION,
+    REQUEST_TIMEOUT,
 )
 
 
@@ -40,7 +42,7 @@ def test_initialize_api():
     # Verify the returned headers.
     assert headers == {"Authorization": "Bearer mock_token"}
 
-@patch("requests.get")
+@patch.object(SESSION, "get")
 def test_fetch_panels(mock_get):
     """Test fetching panels."""
     # Mock the response from the `requests.get` call.
@@ -60,7 +62,7 @@ def test_fetch_panels(mock_get):
     # Ensure the `requests.get` function was called once.
     mock_get.assert_called_once()
 
-@patch("requests.get")
+@patch.object(SESSION, "get")
 def test_fetch_panel_details(mock_get):
     """Test fetching panel details."""
     # Mock the response from the `requests.get` call.
@@ -75,7 +77,9 @@ def test_fetch_panel_details(mock_get):
     # Verify the returned data matches the mocked panel details.
     assert result == {"id": 1, "name": "Mock Panel"}
     # Ensure the `requests.get` function was called with the correct URL and headers.
-    mock_get.assert_called_once_with("mock_url1/", headers={"Authorization": "Bearer mock_token"})
+    mock_get.assert_called_once_with(
+        "mock_url1/", headers={"Authorization": "Bearer mock_token"}, timeout=REQUEST_TIMEOUT
+    )
 
 def test_format_data():
     """Test formatting data into a DataFrame."""
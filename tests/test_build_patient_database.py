@@ -8,8 +8,11 @@ import pandas as pd
 
 from PanelGeneMapper.modules.build_patient_database import (
     load_patient_data,
-    generate_patient_database,
-    save_to_database,
+    generate_patient_rows,
+    get_patient_cache_path,
+    cache_patient_rows,
+    read_cached_patient_rows,
+    save_patient_rows,
 )
 
 
@@ -30,8 +33,8 @@ MOCK_GENERATED_DATA = pd.DataFrame({
 @pytest.fixture
 def mock_os():
     """Fixture to mock os operations."""
-    # Mock `os.path.exists` and `os.makedirs` to avoid real file system changes.
-    with patch("os.path.exists") as mock_exists, patch("os.makedirs") as mock_makedirs:
+    # Mock `os.path.isfile` and `os.makedirs` to avoid real file system changes.
+    with patch("os.path.isfile") as mock_exists, patch("os.makedirs") as mock_makedirs:
         mock_exists.return_value = True  # Simulate that the path always exists.
         yield mock_exists, mock_makedirs  # Yield mocked methods for use in tests.
 
@@ -64,27 +67,73 @@ def test_load_patient_data(mock_os, mock_json):
     # Verify that the returned data matches the mocked JSON data.
     assert data == MOCK_PATIENT_JSON
 
-def test_generate_patient_database_with_provided_data():
-    """Test generating a patient database with user-provided data."""
+def test_generate_patient_rows_with_provided_data():
+    """Test generating patient rows from user-provided data."""
     # Call the function with mocked patient data.
-    df = generate_patient_database(num_patients=0, patient_data=MOCK_PATIENT_JSON)
+    rows = list(generate_patient_rows(num_patients=0, patient_data=MOCK_PATIENT_JSON))
 
-    # Verify that the generated DataFrame matches the mock data exactly.
-    pd.testing.assert_frame_equal(df, MOCK_GENERATED_DATA)
+    # Verify that the generated rows match the mock data exactly.
+    assert rows == list(MOCK_GENERATED_DATA.itertuples(index=False, name=None))
 
-def test_generate_patient_database_without_provided_data():
-    """Test generating a patient database without user-provided data."""
+def test_generate_patient_rows_without_provided_data():
+    """Test generating patient rows without user-provided data."""
     # Specify the number of patients to generate.
     num_patients = 2
 
-    # Call the function to generate the DataFrame.
-    df = generate_patient_database(num_patients=num_patients, patient_data=None)
-
-    # Verify the DataFrame structure and size.
-    assert len(df) == num_patients  # Check the number of generated patients.
-    assert "patient_id" in df.columns  # Verify `patient_id` column exists.
-    assert "clinical_id" in df.columns  # Verify `clinical_id` column exists.
-    assert "test_date" in df.columns  # Verify `test_date` column exists.
-    assert "panel_retrieved_date" in df.columns  # Verify `panel_retrieved_date` column exists.
-
-
+    # Call the function to generate the rows.
+    rows = list(generate_patient_rows(num_patients=num_patients, patient_data=None))
+
+    # Verify the number of generated patients and the patient_data columns of each row.
+    assert len(rows) == num_patients
+    assert all(len(row) == 4 for row in rows)
+
+def test_generate_patient_rows_is_lazy():
+    """Test that patient rows are yielded as tuples in table column order."""
+    # Create the generator without consuming it.
+    rows = generate_patient_rows(num_patients=3, patient_data=None)
+
+    # Verify the first row has the four patient_data columns.
+    first_row = next(rows)
+    assert len(first_row) == 4
+    assert first_row[0].startswith("Patient_")
+    assert first_row[3] == datetime.now().strftime("%Y-%m-%d")
+
+    # Verify the remaining rows are still available.
+    assert len(list(rows)) == 2
+
+def test_save_patient_rows(tmp_path):
+    """Test streaming generated patient rows into a new SQLite database."""
+    # Stream rows from the generator straight into the database.
+    rows = generate_patient_rows(num_patients=0, patient_data=MOCK_PATIENT_JSON)
+    inserted = save_patient_rows(rows, str(tmp_path), "patients.db")
+
+    # Verify the rows were written to the patient_data table.
+    assert inserted == 2
+    with sqlite3.connect(tmp_path / "patients.db") as conn:
+        stored = conn.execute("SELECT patient_id, clinical_id FROM patient_data").fetchall()
+        indexes = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'patient_data'"
+        ).fetchall()
+    assert stored == [("Patient_1", "R169"), ("Patient_2", "R419")]
+    # Verify the join index ships with the new database.
+    assert indexes == [("idx_pd_date",)]
+
+def test_generate_patient_rows_with_seed_is_reproducible():
+    """Test that the same seed generates the same patient rows."""
+    first = list(generate_patient_rows(num_patients=5, patient_data=None, seed=42))
+    second = list(generate_patient_rows(num_patients=5, patient_data=None, seed=42))
+
+    # Verify both runs produced identical rows.
+    assert first == second
+
+def test_patient_rows_cache_round_trip(tmp_path):
+    """Test that cached patient rows are read back unchanged."""
+    cache_path = get_patient_cache_path(5, 42, None, cache_dir=str(tmp_path))
+    rows = list(generate_patient_rows(num_patients=5, patient_data=None, seed=42))
+
+    # Consume the pass-through generator so the cache file is written.
+    assert list(cache_patient_rows(iter(rows), cache_path)) == rows
+    assert os.path.isfile(cache_path)
+
+    # Verify the cached rows match the generated rows.
+    assert list(read_cached_patient_rows(cache_path)) == rows
@@ -4,10 +4,12 @@ from unittest.mock import patch, MagicMock
 
 import pandas as pd
 import pytest
+import requests
 
 from PanelGeneMapper.modules.check_panel_updates import (
     get_panel_app_list,
     compare_panel_versions,
+    iter_panel_app_pages,
 )
 
 
@@ -30,7 +32,7 @@ MOCK_LOCAL_DB_DATA = pd.DataFrame({
 @pytest.fixture
 def mock_api_call():
     """Fixture to mock the PanelApp API calls."""
-    with patch("PanelGeneMapper.modules.check_panel_updates.requests.get") as mock_get:
+    with patch.object(requests.Session, "get") as mock_get:
         def side_effect(*args, **kwargs):
             if "page=2" in args[0]:
                 return MagicMock(ok=True, json=lambda: {"results": [], "next": None})
@@ -73,3 +75,81 @@ def test_get_panel_app_list(mock_api_call):
 
 
 
+
+def test_iter_panel_app_pages_fetches_remaining_pages_concurrently():
+    """Test that pages after the first are requested from the count and yielded in page order."""
+    def side_effect(url, **kwargs):
+        page = int(url.split("page=")[1]) if "page=" in url else 1
+        payload = {
+            "count": 5,
+            "next": None if page == 3 else f"next-{page + 1}",
+            "results": [{"id": page * 10 + i} for i in range(2 if page < 3 else 1)],
+        }
+        return MagicMock(ok=True, json=lambda: payload)
+
+    with patch.object(requests.Session, "get", side_effect=side_effect) as mock_get:
+        pages = list(iter_panel_app_pages())
+
+    assert mock_get.call_count == 3
+    assert pages == [[{"id": 10}, {"id": 11}], [{"id": 20}, {"id": 21}], [{"id": 30}]]
+
+
+def test_compare_panel_versions_reports_differences(tmp_path, monkeypatch):
+    """Test that panels missing on either side are reported as differences."""
+    monkeypatch.setattr("PanelGeneMapper.modules.check_panel_updates.DATABASES_DIR", str(tmp_path))
+    (tmp_path / "panelapp_v20241111.db").touch()
+    with sqlite3.connect(tmp_path / "panelapp_v20250106.db") as conn:
+        conn.execute("CREATE TABLE panel_info (panel_id INTEGER, version TEXT)")
+        conn.executemany("INSERT INTO panel_info VALUES (?, ?)", [(1, "1.0"), (2, "1.5")])
+    conn.close()
+    api_df = pd.DataFrame({"panel_id": [1, 3], "version": ["1.0", "2.0"]})
+
+    with patch("PanelGeneMapper.modules.check_panel_updates.get_panel_app_list", return_value=api_df), \
+         patch("logging.warning") as mock_warning:
+        assert compare_panel_versions() is True
+
+    differences = mock_warning.call_args_list[-1].args[0]
+    assert sorted(differences["panel_id"]) == [2, 3]
+
+
+def test_compare_panel_versions_reports_version_changes(tmp_path, monkeypatch):
+    """Test that panels present on both sides at different versions are reported once per panel."""
+    monkeypatch.setattr("PanelGeneMapper.modules.check_panel_updates.DATABASES_DIR", str(tmp_path))
+    with sqlite3.connect(tmp_path / "panelapp_v20250106.db") as conn:
+        conn.execute("CREATE TABLE panel_info (panel_id INTEGER, version TEXT)")
+        # One row per gene, as in the real panel_info table
+        conn.executemany(
+            "INSERT INTO panel_info VALUES (?, ?)", [(1, "1.0"), (1, "1.0"), (2, "1.5"), (2, "1.5")]
+        )
+    conn.close()
+    api_df = pd.DataFrame({"panel_id": [1, 2], "version": ["1.0", "2.0"]})
+
+    with patch("PanelGeneMapper.modules.check_panel_updates.get_panel_app_list", return_value=api_df), \
+         patch("logging.warning") as mock_warning:
+        compare_panel_versions()
+
+    differences = mock_warning.call_args_list[-1].args[0]
+    assert list(differences["panel_id"]) == [2]
+
+
+def test_compare_panel_versions_no_differences(tmp_path, monkeypatch):
+    """Test that a local database matching the API is reported as unchanged."""
+    monkeypatch.setattr("PanelGeneMapper.modules.check_panel_updates.DATABASES_DIR", str(tmp_path))
+    with sqlite3.connect(tmp_path / "panelapp_v20250106.db") as conn:
+        conn.execute("CREATE TABLE panel_info (panel_id INTEGER, version TEXT)")
+        conn.executemany("INSERT INTO panel_info VALUES (?, ?)", [(1, "1.0"), (2, "1.5")])
+    conn.close()
+    api_df = pd.DataFrame({"panel_id": [1, 2], "version": ["1.0", "1.5"]})
+
+    with patch("PanelGeneMapper.modules.check_panel_updates.get_panel_app_list", return_value=api_df):
+        assert compare_panel_versions() is False
+
+
+def test_compare_panel_versions_no_database(tmp_path, monkeypatch):
+    """Test that a missing local database is logged as an error."""
+    monkeypatch.setattr("PanelGeneMapper.modules.check_panel_updates.DATABASES_DIR", str(tmp_path))
+
+    with patch("logging.error") as mock_error:
+        assert compare_panel_versions() is None
+
+    mock_error.assert_called_once_with("No `panelapp_v` database found in the databases directory.")
@@ -4,7 +4,7 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 
-from PanelGeneMapper.modules.custom_logging import setup_logging
+from PanelGeneMapper.modules.custom_logging import setup_logging, get_log_level
 
 
 @pytest.fixture
@@ -51,3 +51,18 @@ def test_setup_logging_failure(mock_os):
         # Verify that `setup_logging` raises a RuntimeError with the expected message.
         with pytest.raises(RuntimeError, match="Failed to set up logging: Mocked exception"):
             setup_logging()
+
+@pytest.mark.parametrize(
+    "env_value, expected",
+    [(None, logging.INFO), ("debug", logging.DEBUG), ("WARNING", logging.WARNING), ("verbose", logging.INFO)],
+)
+def test_get_log_level(monkeypatch, env_value, expected):
+    """
+    Test that the root log level defaults to INFO and can be overridden by environment variable.
+    """
+    if env_value is None:
+        monkeypatch.delenv("PANELGENEMAPPER_LOG_LEVEL", raising=False)
+    else:
+        monkeypatch.setenv("PANELGENEMAPPER_LOG_LEVEL", env_value)
+
+    assert get_log_level() == expected
@@ -1,17 +1,25 @@
 import os
+import gzip
 import shutil
 import sqlite3
+from unittest.mock import MagicMock, patch
 
 import pytest
 
+from PanelGeneMapper.modules import make_bed_file, retrieve_gene_local_db
 from PanelGeneMapper.modules.make_bed_file import (
     create_local_db,
     cache_exon_data,
+    cache_exon_data_bulk,
     fetch_cached_data,
     extract_ensembl_ids_from_csv,
-    get_mane_exon_data,
+    extract_ensembl_ids_with_join,
     write_bed_file,
     fetch_all_data,
+    TokenBucket,
+    lookup_mane_exon_data,
+    bulk_fetch_cached,
+    sync_cache_release,
 )
 
 @pytest.fixture(scope="function")
@@ -60,6 +68,15 @@ def cleanup_environment():
     # Cleanup local files
     cleanup_test_files()
 
+@pytest.fixture(scope="function")
+def temp_cache_db(tmp_path, monkeypatch):
+    """
+    Point the exon cache at a fresh database file in a temporary directory.
+    """
+    monkeypatch.setattr(make_bed_file, "DB_NAME", str(tmp_path / "gene_data.db"))
+    create_local_db()
+    yield make_bed_file.DB_NAME
+
 def cleanup_test_files():
     """
     Remove test files and directories created during testing.
@@ -78,31 +95,6 @@ def cleanup_test_files():
             if file.endswith(".bed"):
                 os.remove(os.path.join(output_dir, file))
 
-# def test_get_mane_exon_data_success(mock_database):
-#     """
-#     Test that the get_mane_exon_data function returns an expected dictionary 
-#     output when provided with valid inputs.
-#     """
-#     species = "homo_sapiens"
-#     server = "https://rest.ensembl.org"
-#     headers = {"Content-Type": "application/json"}
-#     ensembl_id = "ENSG00000012048"
-
-#     result = get_mane_exon_data(ensembl_id, species, server, headers)
-#     assert type(result) == dict
-
-# def test_get_mane_exon_data_fail(mock_database):
-#     """
-#     Test that the get_mane_exon_data function returns None when an invalid input is provided.
-#     """
-#     species = "test"
-#     server = "https://rest.ensembl.org"
-#     headers = {"Content-Type": "application/json"}
-#     ensembl_id = "ENSG00000012048"
-
-#     result = get_mane_exon_data(ensembl_id, species, server, headers)
-#     assert result is None
-
 def test_write_bed_file_success(mock_database):
     """
     Test that the write_bed_file function creates the expected output file when provided with valid inputs.
@@ -116,3 +108,271 @@ def test_write_bed_file_success(mock_database):
 
     result = write_bed_file(data_list, output_file)
     assert os.path.exists(output_file)
+
+def test_write_bed_file_content(tmp_path):
+    """
+    Test that write_bed_file writes one zero-based line per exon and skips invalid entries.
+    """
+    data_list = [
+        {
+            "seq_region_name": "1",
+            "gene_id": "ENSG00000128973",
+            "gene_name": "CLN6-201",
+            "transcript_type": "MANE_Select",
+            "exons": [{"start": 101, "end": 200}, {"start": 301, "end": 400}],
+        },
+        "ENSG00000136827",
+    ]
+    output_file = tmp_path / "gene_exons.bed"
+
+    write_bed_file(data_list, str(output_file))
+
+    assert output_file.read_text() == (
+        "chr1\t100\t200\tCLN6-201\tENSG00000128973\tMANE_Select\n"
+        "chr1\t300\t400\tCLN6-201\tENSG00000128973\tMANE_Select\n"
+    )
+
+def test_write_bed_file_sorted(tmp_path):
+    """
+    Test that write_bed_file sorts exons by chromosome and start across genes.
+    """
+    data_list = [
+        {"seq_region_name": "2", "gene_id": "G2", "gene_name": "B", "transcript_type": "MANE_Select",
+         "exons": [{"start": 51, "end": 60}]},
+        {"seq_region_name": "1", "gene_id": "G1", "gene_name": "A", "transcript_type": "MANE_Select",
+         "exons": [{"start": 301, "end": 400}, {"start": 101, "end": 200}]},
+    ]
+    output_file = tmp_path / "gene_exons.bed"
+
+    write_bed_file(data_list, str(output_file))
+
+    positions = [line.split("\t")[:2] for line in output_file.read_text().splitlines()]
+    assert positions == [["chr1", "100"], ["chr1", "300"], ["chr2", "50"]]
+
+def test_extract_ensembl_ids_from_csv(tmp_path, monkeypatch):
+    """
+    Test that unique Ensembl IDs are collected across CSV chunks and missing values are skipped.
+    """
+    monkeypatch.setattr(make_bed_file, "CSV_CHUNK_SIZE", 2)
+    csv_file = tmp_path / "gene_list.csv"
+    csv_file.write_text(
+        "patient_id,gene_ensembl_id_GRch38\n"
+        "P1,ENSG00000128973\n"
+        "P2,\n"
+        "P3,ENSG00000136827\n"
+        "P4,ENSG00000128973\n"
+    )
+
+    assert sorted(extract_ensembl_ids_from_csv(str(csv_file))) == ["ENSG00000128973", "ENSG00000136827"]
+
+def test_extract_ensembl_ids_from_csv_missing_column(tmp_path):
+    """
+    Test that a CSV without the Ensembl ID column yields no IDs.
+    """
+    csv_file = tmp_path / "gene_list.csv"
+    csv_file.write_text("patient_id,clinical_id\nP1,R59\n")
+
+    assert extract_ensembl_ids_from_csv(str(csv_file)) == []
+
+def test_cache_exon_data_round_trip(temp_cache_db):
+    """
+    Test that exon data cached for a gene is returned by fetch_cached_data.
+    """
+    cache_exon_data("ENSG00000128973", '{"exons": []}')
+
+    assert fetch_cached_data("ENSG00000128973") == '{"exons": []}'
+    assert fetch_cached_data("ENSG00000000000") is None
+
+def test_cache_exon_data_bulk(temp_cache_db):
+    """
+    Test that exon data for several genes is cached in one call.
+    """
+    cache_exon_data_bulk([
+        ("ENSG00000128973", '{"exons": []}'),
+        ("ENSG00000136827", '{"exons": [1]}'),
+    ])
+
+    assert fetch_cached_data("ENSG00000128973") == '{"exons": []}'
+    assert fetch_cached_data("ENSG00000136827") == '{"exons": [1]}'
+
+def test_cache_exon_data_bulk_rolls_back_on_error(temp_cache_db):
+    """
+    Test that a failed bulk write leaves none of its rows in the cache.
+    """
+    with pytest.raises(sqlite3.ProgrammingError):
+        cache_exon_data_bulk([("ENSG00000128973", '{"exons": []}'), ("ENSG00000136827",)])
+
+    assert fetch_cached_data("ENSG00000128973") is None
+
+def test_bulk_fetch_cached(temp_cache_db, monkeypatch):
+    """
+    Test that cached genes are returned across lookup chunks and uncached genes are left out.
+    """
+    monkeypatch.setattr(make_bed_file, "CACHE_LOOKUP_CHUNK_SIZE", 2)
+    cache_exon_data_bulk([
+        ("ENSG00000128973", '{"exons": []}'),
+        ("ENSG00000136827", '{"exons": [1]}'),
+        ("ENSG00000064601", '{"exons": [2]}'),
+    ])
+
+    cached = bulk_fetch_cached(["ENSG00000128973", "ENSG00000000000", "ENSG00000064601", "ENSG00000136827"])
+
+    assert cached == {
+        "ENSG00000128973": {"exons": []},
+        "ENSG00000136827": {"exons": [1]},
+        "ENSG00000064601": {"exons": [2]},
+    }
+
+def test_token_bucket_consume_and_pause():
+    """
+    Test that the token bucket hands out its capacity and empties on pause.
+    """
+    bucket = TokenBucket(rate=1000, capacity=2)
+    bucket.consume()
+    bucket.consume()
+    assert bucket.tokens < 1
+
+    bucket.pause(0.01)
+    assert bucket.tokens < 0
+    bucket.consume()  # Refills after the pause at 1000 tokens per second
+
+def test_lookup_mane_exon_data_selects_mane_transcript():
+    """
+    Test that a batched lookup keeps only the MANE Select transcript of each gene.
+    """
+    lookup_response = {
+        "ENSG00000012048": {
+            "id": "ENSG00000012048",
+            "Transcript": [
+                {"id": "ENST00000000001", "display_name": "BRCA1-201", "MANE": []},
+                {
+                    "id": "ENST00000357654",
+                    "display_name": "BRCA1-203",
+                    "seq_region_name": "17",
+                    "MANE": [{"type": "MANE_Select"}],
+                    "Exon": [{"start": 100, "end": 200}],
+                },
+            ],
+        },
+        "ENSG00000000000": None,
+    }
+    mock_response = MagicMock(status_code=200, ok=True, headers={})
+    mock_response.json.return_value = lookup_response
+
+    with patch.object(make_bed_file.SESSION, "request", return_value=mock_response) as mock_request:
+        result = lookup_mane_exon_data(
+            ["ENSG00000012048", "ENSG00000000000"],
+            "homo_sapiens",
+            "https://rest.ensembl.org",
+            {"Content-Type": "application/json"},
+        )
+
+    # One POST covers both genes.
+    mock_request.assert_called_once()
+    assert mock_request.call_args.args[0] == "POST"
+    assert list(result) == ["ENSG00000012048"]
+    assert result["ENSG00000012048"]["transcript_id"] == "ENST00000357654"
+    assert result["ENSG00000012048"]["exons"] == [{"start": 100, "end": 200}]
+
+def test_lookup_mane_exon_data_runs_batches_concurrently(monkeypatch):
+    """
+    Test that genes split over several batches are all looked up and merged into one result.
+    """
+    monkeypatch.setattr(make_bed_file, "ENSEMBL_LOOKUP_BATCH_SIZE", 1)
+    gene_ids = ["ENSG00000000001", "ENSG00000000002", "ENSG00000000003"]
+
+    def lookup(method, url, **kwargs):
+        ensembl_id = kwargs["json"]["ids"][0]
+        response = MagicMock(status_code=200, ok=True, headers={})
+        response.json.return_value = {
+            ensembl_id: {
+                "id": ensembl_id,
+                "Transcript": [{"id": f"T{ensembl_id}", "MANE": [{"type": "MANE_Select"}], "Exon": []}],
+            }
+        }
+        return response
+
+    with patch.object(make_bed_file.SESSION, "request", side_effect=lookup) as mock_request:
+        result = lookup_mane_exon_data(gene_ids, "homo_sapiens", "https://rest.ensembl.org", {})
+
+    assert mock_request.call_count == 3
+    assert sorted(result) == gene_ids
+    assert result["ENSG00000000002"]["transcript_id"] == "TENSG00000000002"
+
+def test_fetch_all_data_caches_compact_json(temp_cache_db):
+    """
+    Test that fetch_all_data serves cached genes from the cache and stores new genes as compact JSON.
+    """
+    cache_exon_data("ENSG00000128973", '{"exons": []}')
+    fetched = {"ENSG00000136827": {"gene_id": "ENSG00000136827", "exons": [{"start": 1, "end": 2}]}}
+
+    with patch.object(make_bed_file, "get_ensembl_release", return_value=None), \
+            patch.object(make_bed_file, "lookup_mane_exon_data", return_value=fetched) as mock_lookup:
+        results = fetch_all_data(["ENSG00000128973", "ENSG00000136827"], "homo_sapiens", "https://rest.ensembl.org", {})
+
+    mock_lookup.assert_called_once()
+    assert mock_lookup.call_args.args[0] == ["ENSG00000136827"]
+    assert results == [{"exons": []}, fetched["ENSG00000136827"]]
+    assert fetch_cached_data("ENSG00000136827") == '{"gene_id":"ENSG00000136827","exons":[{"start":1,"end":2}]}'
+
+def test_sync_cache_release_clears_cache_on_new_release(temp_cache_db):
+    """
+    Test that cached exon data is kept for the same Ensembl release and cleared when it changes.
+    """
+    cache_exon_data("ENSG00000128973", '{"exons": []}')
+
+    assert sync_cache_release("113") is False
+    assert sync_cache_release("113") is False
+    assert fetch_cached_data("ENSG00000128973") == '{"exons": []}'
+
+    assert sync_cache_release("114") is True
+    assert fetch_cached_data("ENSG00000128973") is None
+
+def test_create_local_db_clears_cache_without_schema_version(tmp_path, monkeypatch):
+    """
+    Test that exon data cached before the schema version was recorded is discarded once.
+    """
+    db_name = str(tmp_path / "gene_data.db")
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("CREATE TABLE gene_exons (gene_id TEXT PRIMARY KEY, exon_data TEXT)")
+        conn.execute("INSERT INTO gene_exons VALUES ('ENSG00000128973', '{\"exons\": []}')")
+    conn.close()
+    monkeypatch.setattr(make_bed_file, "DB_NAME", db_name)
+
+    create_local_db()
+    assert fetch_cached_data("ENSG00000128973") is None
+
+    cache_exon_data("ENSG00000136827", '{"exons": []}')
+    create_local_db()
+    assert fetch_cached_data("ENSG00000136827") == '{"exons": []}'
+
+def test_extract_ensembl_ids_with_join_uses_archive_for_date(tmp_path, monkeypatch):
+    """
+    Test that a date without a live PanelApp database is looked up in its own archive,
+    not in the latest live database.
+    """
+    databases_dir = tmp_path / "databases"
+    archive_dir = databases_dir / "archive_databases"
+    archive_dir.mkdir(parents=True)
+    monkeypatch.setattr(retrieve_gene_local_db, "get_databases_dir", lambda: str(databases_dir))
+    monkeypatch.setattr(retrieve_gene_local_db, "get_archive_dir", lambda: str(archive_dir))
+
+    patient_db = str(databases_dir / "patient_database.db")
+    with sqlite3.connect(patient_db) as conn:
+        conn.execute("CREATE TABLE patient_data (patient_id TEXT, clinical_id TEXT, panel_retrieved_date TEXT)")
+        conn.execute("INSERT INTO patient_data VALUES ('Patient_1', 'R169', '2024-11-11')")
+    conn.close()
+
+    for path, gene_id in [
+        (databases_dir / "panelapp_v20250106.db", "ENSG_LIVE"),
+        (tmp_path / "panelapp_v20241111.db", "ENSG_ARCHIVED"),
+    ]:
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE panel_info (relevant_disorders TEXT, gene_ensembl_id_GRch38 TEXT)")
+            conn.execute("INSERT INTO panel_info VALUES ('R169', ?)", (gene_id,))
+        conn.close()
+    with open(tmp_path / "panelapp_v20241111.db", "rb") as f_in, \
+            gzip.open(archive_dir / "panelapp_v20241111.db.gz", "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+    assert extract_ensembl_ids_with_join(patient_db=patient_db) == ["ENSG_ARCHIVED"]
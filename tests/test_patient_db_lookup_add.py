@@ -2,14 +2,13 @@ import os
 import sqlite3
 from unittest import mock
 
-import pandas as pd
 import pytest
 
 from PanelGeneMapper.modules.patient_db_lookup_add import (
     get_databases_dir,
     list_patients,
     add_patient,
-    save_to_database,
+    add_patients_bulk,
 )
 
 
@@ -25,7 +24,9 @@ def test_get_databases_dir(mock_database_dir, monkeypatch):
     """Test that `get_databases_dir` creates the correct directory."""
     # Monkeypatch `os.path.abspath` to return the mock directory path.
     monkeypatch.setattr("os.path.abspath", lambda x: str(mock_database_dir))
+    get_databases_dir.cache_clear()  # Drop any path cached by earlier calls.
     result = get_databases_dir()  # Call the function under test.
+    get_databases_dir.cache_clear()  # Do not leak the mocked path to later tests.
     # Verify the directory exists.
     assert os.path.exists(result)
     # Verify the directory's name matches the expected name.
@@ -33,44 +34,103 @@ def test_get_databases_dir(mock_database_dir, monkeypatch):
 
 @mock.patch("sqlite3.connect")
 @mock.patch("os.path.isfile")
-@mock.patch("pandas.read_sql_query")
-def test_list_patients(mock_read_sql, mock_isfile, mock_connect, tmp_path):
+def test_list_patients(mock_isfile, mock_connect, tmp_path):
     """Test the `list_patients` function."""
     # Setup: Mock the responses of dependent functions.
     mock_isfile.return_value = True  # Mock that the database file exists.
     mock_conn = mock.MagicMock()  # Mock a database connection object.
     mock_connect.return_value = mock_conn  # Return the mocked connection.
-    # Mock a DataFrame to simulate the query results.
-    mock_df = pd.DataFrame({"patient_id": ["123"], "clinical_id": ["456"]})
-    mock_read_sql.return_value = mock_df  # Set the mocked return value for SQL query.
+    # Mock the rows returned by the query, followed by the end of the results.
+    mock_conn.execute.return_value.fetchmany.side_effect = [[("123", "456")], []]
 
     # Execute the function under test.
-    result = list_patients(patient_db="test.db", save_to_file=False)
+    with mock.patch("logging.info") as mock_log:
+        list_patients(patient_db="test.db", save_to_file=False)
 
     # Verify: Ensure the mocked methods were called as expected.
     mock_isfile.assert_called_once()  # Verify `os.path.isfile` was called.
     mock_connect.assert_called_once()  # Verify the database connection was opened.
-    mock_read_sql.assert_called_once()  # Verify the SQL query was executed.
-    # Ensure the function's output matches the mocked DataFrame.
-    assert mock_df.equals(mock_read_sql.return_value)
+    mock_conn.execute.assert_any_call(
+        "SELECT DISTINCT patient_id, clinical_id FROM patient_data"
+    )  # Verify the SQL query was executed.
+    # Ensure the listed patients match the query results.
+    assert mock_log.call_args_list[-1].args[0] == "123\t456"
+
+def test_list_patients_save_to_file(mock_database_dir, monkeypatch):
+    """Test that `list_patients` writes the patient list to a CSV file."""
+    # Setup: Create a patient database with two patients.
+    monkeypatch.setattr(
+        "PanelGeneMapper.modules.patient_db_lookup_add.get_databases_dir", lambda: str(mock_database_dir)
+    )
+    with sqlite3.connect(mock_database_dir / "patient_database.db") as conn:
+        conn.execute("CREATE TABLE patient_data (patient_id TEXT, clinical_id TEXT)")
+        conn.executemany("INSERT INTO patient_data VALUES (?, ?)", [("123", "R59"), ("456", "R58")])
+    conn.close()
+
+    # Execute the function under test.
+    list_patients(save_to_file=True)
+
+    # Verify: The CSV holds a header and one line per patient.
+    output_path = mock_database_dir / "output" / "patient_list.csv"
+    with open(output_path, newline="") as f:
+        assert f.read() == os.linesep.join(["patient_id,clinical_id", "123,R59", "456,R58", ""])
 
 @mock.patch("sqlite3.connect")
-@mock.patch("os.listdir")
-@mock.patch("pandas.read_sql_query")
-def test_add_patient(mock_read_sql, mock_listdir, mock_connect, tmp_path):
+@mock.patch("PanelGeneMapper.modules.patient_db_lookup_add.list_panelapp_dbs")
+def test_add_patient(mock_listdir, mock_connect, tmp_path):
     """Test the `add_patient` function."""
     # Setup: Mock the responses of dependent functions.
-    mock_listdir.return_value = ["panelapp_v20220101.db"]  # Simulate database files in the directory.
+    mock_listdir.return_value = ("panelapp_v20220101.db",)  # Simulate database files in the directory.
     mock_conn = mock.MagicMock()  # Mock a database connection object.
     mock_connect.return_value = mock_conn  # Return the mocked connection.
-    # Mock a DataFrame to simulate existing patients in the database.
-    mock_read_sql.return_value = pd.DataFrame({"patient_id": ["123"]})
+    # Simulate the patient not yet being in the database.
+    mock_conn.execute.return_value.fetchone.return_value = None
 
-    # Execute the function under test with a mock for the `to_sql` method.
-    with mock.patch("pandas.DataFrame.to_sql") as mock_to_sql:
-        add_patient("456", "789", "2023-12-31")  # Call the function to add a patient.
-        mock_to_sql.assert_called_once()  # Verify the patient data was written to the database.
+    # Execute the function under test.
+    add_patient("456", "789", "2023-12-31")  # Call the function to add a patient.
+    mock_conn.executemany.assert_called_once()  # Verify the patient data was written to the database.
 
     # Verify: Ensure the mocked methods were called as expected.
-    mock_read_sql.assert_called_once()  # Verify the SQL query for existing patients was executed.
+    mock_conn.execute.assert_any_call(
+        "SELECT 1 FROM patient_data WHERE patient_id = ? LIMIT 1", ("456",)
+    )  # Verify only the new patient ID was looked up.
     mock_listdir.assert_called_once()  # Verify the directory listing was checked.
+
+@mock.patch("sqlite3.connect")
+@mock.patch("PanelGeneMapper.modules.patient_db_lookup_add.list_panelapp_dbs")
+def test_add_patient_existing(mock_listdir, mock_connect):
+    """Test that `add_patient` does not add a patient that already exists."""
+    # Setup: Simulate the patient already being in the database.
+    mock_conn = mock.MagicMock()
+    mock_connect.return_value = mock_conn
+    mock_conn.execute.return_value.fetchone.return_value = (1,)
+
+    # Execute the function under test.
+    add_patient("123", "789", "2023-12-31")
+
+    # Verify: Nothing was written and the PanelApp databases were not looked up.
+    mock_conn.executemany.assert_not_called()
+    mock_listdir.assert_not_called()
+
+def test_add_patients_bulk(mock_database_dir):
+    """Test that `add_patients_bulk` inserts every row tuple into the patient table."""
+    # Setup: Create an empty patient database.
+    database_path = mock_database_dir / "patient_database.db"
+    with sqlite3.connect(database_path) as conn:
+        conn.execute(
+            "CREATE TABLE patient_data (patient_id TEXT, clinical_id TEXT, test_date TEXT, panel_retrieved_date TEXT)"
+        )
+    conn.close()
+    rows = [
+        ("456", "R58", "2023-12-31", "2024-12-20"),
+        ("789", "R59", "2024-01-01", "2024-12-20"),
+    ]
+
+    # Execute the function under test.
+    add_patients_bulk(rows, str(mock_database_dir))
+
+    # Verify: Both rows were written in order.
+    with sqlite3.connect(database_path) as conn:
+        stored = conn.execute("SELECT * FROM patient_data").fetchall()
+    conn.close()
+    assert stored == rows
@@ -2,15 +2,21 @@ import os
 import sqlite3
 import gzip
 import tempfile
+from unittest.mock import patch
 
 import pandas as pd
 import pytest
 
+from PanelGeneMapper.modules import retrieve_gene_local_db
 from PanelGeneMapper.modules.retrieve_gene_local_db import (
     get_databases_dir,
     get_archive_dir,
     retrieve_latest_panelapp_db,
     connect_and_join_databases,
+    extract_archived_db,
+    list_panelapp_dbs,
+    iter_archived_dbs,
+    open_sqlite_ro,
 )
 
 
@@ -38,6 +44,347 @@ def setup_environment():
     }
 
 
+@pytest.fixture
+def join_environment(tmp_path, monkeypatch):
+    """
+    Create a patient database and a dated PanelApp database in a temporary
+    databases directory, with the module pointed at it.
+    """
+    databases_dir = tmp_path / "databases"
+    archive_dir = databases_dir / "archive_databases"
+    archive_dir.mkdir(parents=True)
+    monkeypatch.setattr(retrieve_gene_local_db, "get_databases_dir", lambda: str(databases_dir))
+    monkeypatch.setattr(retrieve_gene_local_db, "get_archive_dir", lambda: str(archive_dir))
+
+    patient_db = databases_dir / "patient_database.db"
+    with sqlite3.connect(patient_db) as conn:
+        pd.DataFrame({
+            "patient_id": ["Patient_1", "Patient_2", "Patient_3"],
+            "clinical_id": ["R169", "R419", "R169"],
+            "test_date": ["2024-12-01", "2024-12-02", "2024-12-03"],
+            "panel_retrieved_date": ["2024-12-20", "2024-12-20", "2024-12-20"],
+        }).to_sql("patient_data", conn, index=False)
+
+    with sqlite3.connect(databases_dir / "panelapp_v20241220.db") as conn:
+        pd.DataFrame({
+            "name": ["Panel A", "Panel A", "Panel B"],
+            "version": ["1.0", "1.0", "2.1"],
+            "version_created": ["2024-01-01", "2024-01-01", "2024-02-01"],
+            "relevant_disorders": ["R169", "R169", "R419"],
+            "hgnc_symbol": ["GENE1", "GENE2", "GENE3"],
+            "hgnc_id": ["HGNC:1", "HGNC:2", "HGNC:3"],
+            "gene_ensembl_id_GRch38": ["ENSG01", "ENSG02", "ENSG03"],
+        }).to_sql("panel_info", conn, index=False)
+
+    return {"patient_db": str(patient_db), "output_file": str(tmp_path / "output" / "gene_list.csv")}
+
+
+def test_connect_and_join_databases(join_environment):
+    """
+    Test that patients are joined to the genes of their PanelApp panel.
+    """
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+    )
+
+    result = pd.read_csv(join_environment["output_file"])
+    assert list(result.columns) == [
+        "patient_id", "clinical_id", "test_date", "panel_retrieved_date",
+        "disease_name", "version", "version_created", "panel_r_code",
+        "hgnc_symbol", "hgnc_id", "gene_ensembl_id_GRch38",
+    ]
+    assert sorted(zip(result["patient_id"], result["hgnc_symbol"])) == [
+        ("Patient_1", "GENE1"), ("Patient_1", "GENE2"),
+        ("Patient_2", "GENE3"),
+        ("Patient_3", "GENE1"), ("Patient_3", "GENE2"),
+    ]
+
+
+def test_connect_and_join_databases_filters_by_r_code(join_environment):
+    """
+    Test that only patients with the requested R code are joined.
+    """
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+        r_code="R419",
+    )
+
+    result = pd.read_csv(join_environment["output_file"])
+    assert result["patient_id"].tolist() == ["Patient_2"]
+    assert result["disease_name"].tolist() == ["Panel B"]
+
+
+def test_connect_and_join_databases_specific_date(join_environment):
+    """
+    Test that a specific date with no patients writes no output.
+    """
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+        specific_date="2023-01-01",
+    )
+    assert not os.path.exists(join_environment["output_file"])
+
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+        specific_date="2024-12-20",
+    )
+    assert len(pd.read_csv(join_environment["output_file"])) == 5
+
+
+def test_connect_and_join_databases_uses_archive(join_environment, tmp_path):
+    """
+    Test that an archived PanelApp database is used when the live one is missing,
+    without leaving a decompressed copy on disk.
+    """
+    databases_dir = tmp_path / "databases"
+    live_db = databases_dir / "panelapp_v20241220.db"
+    with open(live_db, "rb") as f_in, gzip.open(databases_dir / "archive_databases" / "panelapp_v20241220.db.gz", "wb") as f_out:
+        f_out.write(f_in.read())
+    live_db.unlink()
+
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+    )
+
+    assert len(pd.read_csv(join_environment["output_file"])) == 5
+    assert sorted(p.name for p in databases_dir.glob("*.db")) == ["patient_database.db"]
+
+
+def test_connect_and_join_databases_uses_archive_without_deserialize(join_environment, tmp_path, monkeypatch):
+    """
+    Test that archived PanelApp databases are attached from temporary files when
+    sqlite3 cannot deserialize (Python < 3.11), and the files are removed afterwards.
+    """
+    temp_dir = tmp_path / "tmp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+    monkeypatch.setattr(retrieve_gene_local_db, "RAMDISK_DIR", str(tmp_path / "missing"))
+    monkeypatch.setattr(retrieve_gene_local_db, "CAN_DESERIALIZE", False)
+    databases_dir = tmp_path / "databases"
+    live_db = databases_dir / "panelapp_v20241220.db"
+    with open(live_db, "rb") as f_in, gzip.open(databases_dir / "archive_databases" / "panelapp_v20241220.db.gz", "wb") as f_out:
+        f_out.write(f_in.read())
+    live_db.unlink()
+
+
+    class PreDeserializeConnection(sqlite3.Connection):
+        """Connection behaving like Python < 3.11, which has no deserialize method."""
+
+        def deserialize(self, *args, **kwargs):
+            raise AttributeError("'sqlite3.Connection' object has no attribute 'deserialize'")
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(
+        sqlite3, "connect", lambda *args, **kwargs: connect(*args, factory=PreDeserializeConnection, **kwargs)
+    )
+
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+    )
+
+    assert len(pd.read_csv(join_environment["output_file"])) == 5
+    assert list(temp_dir.glob("panelapp_*")) == []
+
+
+def test_iter_archived_dbs(tmp_path):
+    """
+    Test that archives are yielded decompressed and in the order requested.
+    """
+    archive_paths = []
+    for i in range(4):
+        archive_path = tmp_path / f"panelapp_v2024010{i}.db.gz"
+        with gzip.open(archive_path, "wb") as f_out:
+            f_out.write(f"database {i}".encode())
+        archive_paths.append(str(archive_path))
+
+    assert list(iter_archived_dbs(archive_paths, prefetch=2)) == [
+        b"database 0", b"database 1", b"database 2", b"database 3",
+    ]
+    assert list(iter_archived_dbs([])) == []
+
+
+def test_iter_archived_dbs_to_file_closed_early(tmp_path, monkeypatch):
+    """
+    Test that closing the file-based prefetcher early removes unused temporary copies
+    and shuts its executor down.
+    """
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(retrieve_gene_local_db, "RAMDISK_DIR", str(tmp_path / "missing"))
+    executors = []
+
+    class RecordingExecutor(retrieve_gene_local_db.ThreadPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            executors.append(self)
+
+    monkeypatch.setattr(retrieve_gene_local_db, "ThreadPoolExecutor", RecordingExecutor)
+    archive_paths = []
+    for i in range(4):
+        archive_path = tmp_path / f"archive_{i}.db.gz"
+        with gzip.open(archive_path, "wb") as f_out:
+            f_out.write(f"database {i}".encode())
+        archive_paths.append(str(archive_path))
+
+    archived_dbs = iter_archived_dbs(archive_paths, prefetch=2, to_file=True)
+    first = next(archived_dbs)
+    with open(first, "rb") as f:
+        assert f.read() == b"database 0"
+    retrieve_gene_local_db.remove_temp_file(first)
+    archived_dbs.close()
+
+    assert list(tmp_path.glob("panelapp_*")) == []
+    assert executors and all(executor._shutdown for executor in executors)
+
+
+def test_extract_archived_db(tmp_path):
+    """
+    Test that an archived database is decompressed into a readable temporary file.
+    """
+    source_db = tmp_path / "panelapp_v20240101.db"
+    with sqlite3.connect(source_db) as conn:
+        conn.execute("CREATE TABLE panel_info (panel_id INTEGER)")
+        conn.execute("INSERT INTO panel_info VALUES (1)")
+    conn.close()
+    archive_path = tmp_path / "panelapp_v20240101.db.gz"
+    with open(source_db, "rb") as f_in, gzip.open(archive_path, "wb") as f_out:
+        f_out.write(f_in.read())
+
+    extracted = extract_archived_db(str(archive_path), dest_dir=str(tmp_path))
+
+    assert os.path.dirname(extracted) == str(tmp_path)
+    with sqlite3.connect(extracted) as conn:
+        assert conn.execute("SELECT panel_id FROM panel_info").fetchall() == [(1,)]
+    conn.close()
+
+
+def test_extract_archived_db_default_dir(tmp_path, monkeypatch):
+    """
+    Test that archives are decompressed to the system temporary directory and cleaned up at exit.
+    """
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(retrieve_gene_local_db, "RAMDISK_DIR", str(tmp_path / "missing"))
+    archive_path = tmp_path / "panelapp_v20240101.db.gz"
+    with gzip.open(archive_path, "wb") as f_out:
+        f_out.write(b"database")
+
+    with patch("atexit.register") as mock_register:
+        extracted = extract_archived_db(str(archive_path))
+
+    assert os.path.dirname(extracted) == str(tmp_path)
+    assert os.path.basename(extracted).startswith("panelapp_")
+    mock_register.assert_called_once_with(retrieve_gene_local_db.remove_temp_file, extracted)
+    retrieve_gene_local_db.remove_temp_file(extracted)
+    retrieve_gene_local_db.remove_temp_file(extracted)  # Already removed; must not raise
+    assert not os.path.exists(extracted)
+
+
+def test_extract_archived_db_prefers_ramdisk(tmp_path, monkeypatch):
+    """
+    Test that archives are decompressed to the RAM-backed directory when it is available.
+    """
+    ramdisk = tmp_path / "shm"
+    ramdisk.mkdir()
+    monkeypatch.setattr(retrieve_gene_local_db, "RAMDISK_DIR", str(ramdisk))
+    archive_path = tmp_path / "panelapp_v20240101.db.gz"
+    with gzip.open(archive_path, "wb") as f_out:
+        f_out.write(b"database")
+
+    extracted = extract_archived_db(str(archive_path))
+
+    assert os.path.dirname(extracted) == str(ramdisk)
+    with open(extracted, "rb") as f:
+        assert f.read() == b"database"
+    retrieve_gene_local_db.remove_temp_file(extracted)
+
+
+def test_connect_and_join_databases_leaves_databases_unchanged(join_environment):
+    """
+    Test that joining only reads the patient and PanelApp databases.
+    """
+    databases_dir = os.path.dirname(join_environment["patient_db"])
+    paths = [join_environment["patient_db"], os.path.join(databases_dir, "panelapp_v20241220.db")]
+    before = {path: open(path, "rb").read() for path in paths}
+
+    connect_and_join_databases(
+        patient_db=join_environment["patient_db"],
+        output_file=join_environment["output_file"],
+    )
+
+    assert os.path.isfile(join_environment["output_file"])
+    assert {path: open(path, "rb").read() for path in paths} == before
+
+
+def test_retrieve_latest_panelapp_db_uses_given_archive_folder(tmp_path, monkeypatch):
+    """
+    Test that the latest archive is chosen from and read from the archive folder passed in.
+    """
+    databases_dir = tmp_path / "databases"
+    default_archive_dir = databases_dir / "archive_databases"
+    default_archive_dir.mkdir(parents=True)
+    archive_folder = tmp_path / "other_archive"
+    archive_folder.mkdir()
+    monkeypatch.setattr(retrieve_gene_local_db, "get_databases_dir", lambda: str(databases_dir))
+    monkeypatch.setattr(retrieve_gene_local_db, "get_archive_dir", lambda: str(default_archive_dir))
+
+    with gzip.open(default_archive_dir / "panelapp_v20250101.db.gz", "wb") as f:
+        f.write(b"default archive")
+    with gzip.open(archive_folder / "panelapp_v20241111.db.gz", "wb") as f:
+        f.write(b"given archive")
+
+    path, is_temp = retrieve_gene_local_db.retrieve_latest_panelapp_db(archive_folder=str(archive_folder))
+    assert is_temp is True
+    with open(path, "rb") as f:
+        assert f.read() == b"given archive"
+    retrieve_gene_local_db.remove_temp_file(path)
+
+
+def test_list_panelapp_dbs(tmp_path):
+    """
+    Test that PanelApp databases are listed newest first and the listing follows directory changes.
+    """
+    for name in [
+        "panelapp_v20240101.db", "panelapp_v20241220.db", "panelapp_vlatest.db",
+        "patient_database.db", "panelapp_v20230101.db.gz",
+    ]:
+        (tmp_path / name).touch()
+
+    assert list_panelapp_dbs(str(tmp_path)) == ("panelapp_v20241220.db", "panelapp_v20240101.db")
+    assert list_panelapp_dbs(str(tmp_path), suffix=".db.gz") == ("panelapp_v20230101.db.gz",)
+
+    (tmp_path / "panelapp_v20240101.db").unlink()
+    os.utime(tmp_path, ns=(0, 0))
+    assert list_panelapp_dbs(str(tmp_path)) == ("panelapp_v20241220.db",)
+
+
+def test_open_sqlite_ro(tmp_path):
+    """
+    Test that a read-only connection can query but not modify the database.
+    """
+    db_path = tmp_path / "panelapp v20240101.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE panel_info (panel_id INTEGER)")
+        conn.execute("INSERT INTO panel_info VALUES (1)")
+    conn.close()
+
+    conn = open_sqlite_ro(str(db_path))
+    try:
+        assert conn.execute("SELECT panel_id FROM panel_info").fetchall() == [(1,)]
+        assert conn.execute("PRAGMA temp_store").fetchone() == (2,)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO panel_info VALUES (2)")
+    finally:
+        conn.close()
+
+    with pytest.raises(sqlite3.OperationalError):
+        open_sqlite_ro(str(tmp_path / "missing.db"))
+
+
 def test_get_databases_dir():
     """
     Test that `get_databases_dir` returns the correct path and ensures the directory exists.